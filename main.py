@@ -4,24 +4,169 @@
     E-mail: gmcadams1@comcast.net
 """
 import sys
+import json
+import argparse
 from src.runner import AITester
+from src.sweep import Sweep, new_tester
 
-if __name__ == "__main__":
-    if len(sys.argv) <= 1:
-        print("Usage: <# games> <# moves per game> <# rows> <# cols>")
-        sys.exit()
-    
-    player_type = input("Is player smart?(y or n)")
+# "9" or "9x12", as [rows, cols]
+def board_size(text):
+    parts = text.lower().split("x")
+    if len(parts) == 1:
+        return [int(parts[0]), int(parts[0])]
+    return [int(parts[0]), int(parts[1])]
+
+# "1-50" (or one seed), as [first, last]
+def seed_range(text):
+    parts = text.split("-")
+    return [int(parts[0]), int(parts[-1])]
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Play games with the simulator's players. With only the "
+            "positional arguments the player is asked for interactively; --player runs without asking, "
+            "and --config, --out or several values for a grid setting run a sweep (see src/sweep.py).")
+    parser.add_argument("games", type=int, nargs="?", help="# games")
+    parser.add_argument("moves", type=int, nargs="?", help="# moves per game")
+    parser.add_argument("rows", type=int, nargs="?", help="# rows")
+    parser.add_argument("cols", type=int, nargs="?", help="# cols")
+    parser.add_argument("log", nargs="?", help="log file, binary records if it ends in .bin")
+    parser.add_argument("--config", help="JSON sweep config; the options below override it")
+    parser.add_argument("--player", choices=["ai", "mcts", "random"])
+    # Same as the positional arguments
+    parser.add_argument("--games", dest="games_option", type=int)
+    parser.add_argument("--moves", dest="moves_option", type=int)
+    # Grid settings, a sweep plays every combination
+    parser.add_argument("--depth", dest="depth_limit", type=int, nargs="+", help="max tree depth, 0 for no limit")
+    parser.add_argument("--beam", dest="beam_width", type=int, nargs="+")
+    parser.add_argument("--size", type=board_size, nargs="+", help="board sizes, e.g. 9 or 9x12")
+    parser.add_argument("--mode", nargs="+", choices=["main", "time", "jelly", "main+jelly"])
+    parser.add_argument("--objective", nargs="+", choices=["score", "jelly"],
+            help="AI heuristic, by default jelly in the jelly modes")
+    parser.add_argument("--seeds", type=seed_range, nargs="+", help="seed ranges, e.g. 1-50")
+    parser.add_argument("--engine", choices=["object", "array", "array+wave"])
+    parser.add_argument("--rng", choices=["shared", "board", "known"], help="board random streams, see Driver.RNG")
+    parser.add_argument("--search", choices=["tree", "undo"])
+    parser.add_argument("--search-workers", type=int)
+    parser.add_argument("--game-workers", type=int)
+    parser.add_argument("--table-size", type=int, help="AI transposition table states, needs --rng board or known")
+    parser.add_argument("--reuse-tree", action="store_const", const=True)
+    parser.add_argument("--time-limit", type=float, help="seconds per move, 0 for no limit")
+    parser.add_argument("--rollouts", type=int, help="MCTS rollouts per move, 0 for no limit")
+    parser.add_argument("--rollout-depth", type=int, help="random moves per MCTS rollout, 0 to the end of the game")
+    parser.add_argument("--batch-size", type=int, help="random games per batch, 0 for one at a time")
+    parser.add_argument("--score-goal", type=int)
+    parser.add_argument("--jelly", type=int, help="jelly squares in the jelly modes")
+    parser.add_argument("--time-goal", type=float, help="seconds per game in time mode")
+    parser.add_argument("--profile", action="store_const", const=True)
+    parser.add_argument("--profile-path", help="write the profile as JSON instead of printing it")
+    parser.add_argument("--jobs", type=int, help="sweep cells played side by side")
+    parser.add_argument("--out", help="sweep output directory")
+    args = parser.parse_args(argv)
+    # A config file may still give the time limit
+    if args.player in [None, "ai"] and args.depth_limit != None and 0 in args.depth_limit \
+            and (args.time_limit == None or args.time_limit <= 0) and args.config == None:
+        parser.error("--depth 0 (no limit) needs a --time-limit")
+    return args
+
+# Settings (see sweep.SETTINGS) given on the command line
+def settings_from(args):
+    settings = {}
+    for name in ["player", "engine", "rng", "search", "search_workers", "game_workers", "table_size", "reuse_tree",
+                 "time_limit", "rollouts", "rollout_depth", "batch_size", "score_goal", "jelly", "time_goal", "profile",
+                 "profile_path", "depth_limit", "beam_width", "size", "mode", "objective", "seeds", "jobs", "out"]:
+        if getattr(args, name) != None:
+            settings[name] = getattr(args, name)
+    if args.games != None:
+        settings["games"] = args.games
+    if args.games_option != None:
+        settings["games"] = args.games_option
+    if args.moves != None:
+        settings["moves"] = args.moves
+    if args.moves_option != None:
+        settings["moves"] = args.moves_option
+    if args.rows != None:
+        settings["rows"] = args.rows
+    if args.cols != None:
+        settings["cols"] = args.cols
+    if args.log != None:
+        settings["log_path"] = args.log
+    return settings
+
+# The original prompts, for a run with only the positional arguments
+def ask_tester(args):
+    player_type = input("Is player smart?(y, n or m for Monte Carlo tree search)")
+    game_workers = int(input("Enter number of game workers:"))
     if player_type == 'y':
-        depth = int(input("Enter max tree depth:"))
+        depth = int(input("Enter max tree depth (0 for no limit with a time limit):"))
         beam_width = int(input("Enter beam width:"))
-        test = AITester(int(sys.argv[1]),
-                {"score":5000000,"moves":int(sys.argv[2])},
-                int(sys.argv[3]),int(sys.argv[4]),depth,beam_width)
+        workers = int(input("Enter number of search workers:"))
+        time_limit = float(input("Enter seconds per move (0 for no limit):"))
+        if depth <= 0 and time_limit <= 0:
+            print("ERROR: Need a tree depth or seconds per move")
+            raise ValueError("Need a tree depth or seconds per move")
+        test = AITester(args.games,
+                {"score":5000000,"moves":args.moves},
+                args.rows,args.cols,depth if depth > 0 else None,beam_width)
         test.issmart = True
+        test.time_limit = time_limit if time_limit > 0 else None
+        test.search_workers = workers
+        test.game_workers = game_workers
+    elif player_type == 'm':
+        rollouts = int(input("Enter rollouts per move (0 for no limit):"))
+        time_limit = float(input("Enter seconds per move (0 for no limit):"))
+        test = AITester(args.games,
+                {"score":5000000,"moves":args.moves},
+                args.rows,args.cols,-1,-1)
+        test.issmart = True
+        test.player = "mcts"
+        test.rollouts = rollouts if rollouts > 0 else None
+        test.time_limit = time_limit if time_limit > 0 else None
+        test.game_workers = game_workers
     else:
-        test = AITester(int(sys.argv[1]),
-                {"score":5000000,"moves":int(sys.argv[2])},
-                int(sys.argv[3]),int(sys.argv[4]),-1,-1)
+        test = AITester(args.games,
+                {"score":5000000,"moves":args.moves},
+                args.rows,args.cols,-1,-1)
         test.issmart = False
-    test.start()
\ No newline at end of file
+        test.game_workers = game_workers
+        test.batch_size = int(input("Enter batch size (0 for one game at a time):"))
+    # Stream every move and game to a log; a .bin file gets the binary format
+    if args.log != None:
+        test.log_path = args.log
+        if test.log_path.endswith(".bin"):
+            test.log_format = "binary"
+    return test
+
+if __name__ == "__main__":
+    if len(sys.argv) <= 1:
+        print("Usage: <# games> <# moves per game> <# rows> <# cols> [log file] [options], or --help")
+        sys.exit()
+
+    args = parse_args(sys.argv[1:])
+    settings = settings_from(args)
+    grid = [name for name in Sweep.GRID if name in settings and len(settings[name]) > 1]
+    if args.config != None or args.out != None or len(grid) > 0:
+        config = {}
+        if args.config != None:
+            with open(args.config) as f:
+                config = json.load(f)
+        config.update(settings)
+        Sweep(config).run()
+    elif args.player != None:
+        # One value of each grid setting, one run
+        for name in Sweep.GRID:
+            if name in settings:
+                settings[name] = settings[name][0]
+        if "size" in settings:
+            settings["rows"], settings["cols"] = settings.pop("size")
+        if "seeds" in settings:
+            seeds = settings.pop("seeds")
+            settings["first_seed"] = seeds[0]
+            settings["games"] = seeds[1]-seeds[0]+1
+        for name in ["jobs", "out"]:
+            settings.pop(name, None)
+        new_tester(settings).start()
+    else:
+        if args.cols == None:
+            print("ERROR: Need <# games> <# moves per game> <# rows> <# cols>")
+            raise Exception("Need <# games> <# moves per game> <# rows> <# cols>")
+        ask_tester(args).start()
@@ -0,0 +1,204 @@
+"""
+    Filename: benchmark.py
+    Author: Gregory McAdams
+    E-mail: gmcadams1@comcast.net
+"""
+import sys
+import json
+import time
+import random
+import platform
+from src.cc_simulator import Driver, AIPlayer, random_move, CANDY_MASK, CHOCOLATE
+
+# Fixed workloads for measuring the engines and the AI search
+# Every workload reseeds the random module, so each run does exactly the same
+# work: the "check" value of a result (score or node count) only changes when
+# the game itself changes, and the rate is work per second, higher is better
+# Each timing is the best of Benchmark.repeat runs
+class Benchmark:
+    SIZES = [5, 9, 12]
+    ENGINES = ["object", "array"]
+    AI_SETTINGS = [(2, 9), (3, 16), (4, 25)]   # (depth limit, beam width)
+    SEED = 1
+    COPIES = 2000   # Board copies timed per size
+    MOVES = 300 # Random moves timed per size
+    POSITIONS = 20  # Boards whose children h_func scores, and whose swaps the cascades resolve
+    AI_MOVES = 3    # AIPlayer moves per setting
+
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.results = {}
+
+    # A started board of size x size, the same for every engine
+    def new_board(self, engine, size):
+        test = Driver(Benchmark.SEED)
+        test.append_game(size,size,"main",engine)
+        board = test.gameBoards[0]
+        board.start({"score":10**9,"moves":10**9})
+        return board
+
+    def add(self, name, work, seconds, unit, check):
+        self.results[name] = {"rate":work/seconds, "unit":unit, "work":work, "check":check}
+
+    def bench_copies(self, engine, size):
+        board = self.new_board(engine, size)
+        best = None
+        for r in range(self.repeat):
+            start = time.perf_counter()
+            for i in range(Benchmark.COPIES):
+                board.copyme()
+            elapsed = time.perf_counter() - start
+            if best == None or elapsed < best:
+                best = elapsed
+        self.add("copies/"+engine+"/"+str(size), Benchmark.COPIES, best, "copies/s", board.hash_key())
+
+    def bench_moves(self, engine, size):
+        board = self.new_board(engine, size)
+        best = None
+        for r in range(self.repeat):
+            play = board.copyme()
+            random.seed(Benchmark.SEED)
+            start = time.perf_counter()
+            for i in range(Benchmark.MOVES):
+                random_move(play)
+            elapsed = time.perf_counter() - start
+            if best == None or elapsed < best:
+                best = elapsed
+        self.add("moves/"+engine+"/"+str(size), Benchmark.MOVES, best, "moves/s", play.score)
+
+    # Cascade resolution alone: update_board until the board settles, on
+    # copies of POSITIONS boards along a random game with one of their valid
+    # swaps of two plain candies already made (specials combine in move
+    # instead); the cascades are the board updates that crushed something
+    def bench_cascades(self, engine, size):
+        board = self.new_board(engine, size)
+        random.seed(Benchmark.SEED)
+        swapped = []
+        for i in range(Benchmark.POSITIONS):
+            while len(board.legal_moves()) == 0:
+                board.shuffle()
+            cells = board.encode()
+            for row, col, direction in board.legal_moves():
+                toRow, toCol = (row, col+1) if direction == "r" else (row+1, col)
+                if cells[row*size+col] & CANDY_MASK < CHOCOLATE and cells[toRow*size+toCol] & CANDY_MASK < CHOCOLATE:
+                    child = board.copyme()
+                    child.swap_candy(row, col, toRow, toCol)
+                    swapped.append(child)
+            random_move(board)
+        best = None
+        for r in range(self.repeat):
+            boards = [child.copyme() for child in swapped]
+            random.seed(Benchmark.SEED)
+            cascades = 0
+            start = time.perf_counter()
+            for child in boards:
+                while child.update_board() == True:
+                    cascades = cascades + 1
+            elapsed = time.perf_counter() - start
+            if best == None or elapsed < best:
+                best = elapsed
+        self.add("cascades/"+engine+"/"+str(size), cascades, best, "cascades/s", cascades)
+
+    # AIPlayer.h_func_batch over every child of POSITIONS boards along a random game
+    def bench_h_func(self, engine, size):
+        board = self.new_board(engine, size)
+        random.seed(Benchmark.SEED)
+        positions = []
+        for i in range(Benchmark.POSITIONS):
+            while len(board.legal_moves()) == 0:
+                board.shuffle()
+            children = []
+            for move in board.legal_moves():
+                child = board.copyme()
+                child.move(move[0],move[1],move[2])
+                children.append(child)
+            positions.append((board.copyme(), children))
+            random_move(board)
+        player = AIPlayer(1, 1)
+        evaluations = 0
+        for parent, children in positions:
+            evaluations = evaluations + len(children)
+        best = None
+        for r in range(self.repeat):
+            total = 0
+            start = time.perf_counter()
+            for parent, children in positions:
+                for h_val in player.h_func_batch(parent, children, 1):
+                    total = total + h_val
+            elapsed = time.perf_counter() - start
+            if best == None or elapsed < best:
+                best = elapsed
+        self.add("h_func/"+engine+"/"+str(size), evaluations, best, "evaluations/s", total)
+
+    # Whole AIPlayer moves of a seeded game; the check is the nodes expanded
+    # With rng "known" the game is a fixed script of refills (see Driver.RNG)
+    def bench_ai(self, engine, size, depth_limit, beam_width, rng=None):
+        best = None
+        for r in range(self.repeat):
+            test = Driver(Benchmark.SEED, rng)
+            test.append_game(size,size,"main",engine)
+            test.append_player("ai",depth_limit,beam_width)
+            start = time.perf_counter()
+            test.play_game(0,0,{"score":10**9,"moves":Benchmark.AI_MOVES})
+            elapsed = time.perf_counter() - start
+            if best == None or elapsed < best:
+                best = elapsed
+        name = "ai/"+engine+"/"+str(size)+"/d"+str(depth_limit)+"b"+str(beam_width)
+        if rng != None:
+            name = name+"/"+rng
+        self.add(name, Benchmark.AI_MOVES, best, "moves/s", test.players[0].nodes_expanded)
+
+    def run(self):
+        for engine in Benchmark.ENGINES:
+            for size in Benchmark.SIZES:
+                print("Benchmarking "+engine+" "+str(size)+"x"+str(size), file=sys.stderr)
+                self.bench_copies(engine, size)
+                self.bench_moves(engine, size)
+                self.bench_cascades(engine, size)
+                self.bench_h_func(engine, size)
+                for depth_limit, beam_width in Benchmark.AI_SETTINGS:
+                    self.bench_ai(engine, size, depth_limit, beam_width)
+                depth_limit, beam_width = Benchmark.AI_SETTINGS[1]
+                self.bench_ai(engine, size, depth_limit, beam_width, "known")
+        return {"python":platform.python_version(),
+                "machine":platform.machine(),
+                "repeat":self.repeat,
+                "results":self.results}
+
+# Workloads whose rate fell more than tolerance below the baseline's, or whose
+# check no longer matches (the game changed, so the rates are not comparable)
+# Returns (name, baseline rate, rate, problem) tuples
+def compare(report, baseline, tolerance=0.1):
+    problems = []
+    for name in sorted(baseline["results"]):
+        old = baseline["results"][name]
+        new = report["results"].get(name)
+        if new == None:
+            problems.append((name, old["rate"], None, "missing"))
+        elif new["check"] != old["check"]:
+            problems.append((name, old["rate"], new["rate"], "changed"))
+        elif new["rate"] < old["rate"]*(1-tolerance):
+            problems.append((name, old["rate"], new["rate"], "slower"))
+    return problems
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ["-h", "--help"]:
+        print("Usage: python -m src.benchmark [results file] [baseline file] [tolerance]")
+        sys.exit()
+
+    report = Benchmark().run()
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            baseline = json.load(f)
+        tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+        problems = compare(report, baseline, tolerance)
+        for name, old, new, problem in problems:
+            print(name+": "+problem+" (baseline "+str(old)+", now "+str(new)+")", file=sys.stderr)
+        if len(problems) > 0:
+            sys.exit(1)
+        print("No regressions against "+sys.argv[2], file=sys.stderr)
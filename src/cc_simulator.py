@@ -8,11 +8,48 @@ import abc
 import time
 import copy
 import math
-
-def avg_row(anode):
-    gb = anode.obj
-    lm = gb.last_move
-
+import re
+import array
+import collections
+import operator
+import concurrent.futures
+
+# Cell encoding used by ArrayGameBoard, one byte per square
+# Bits 0-2 hold the color index into Candy.COLORS (6 is chocolate, 7 is no candy)
+# Bit 3 marks a striped candy, bit 4 a horizontal stripe,
+# bit 5 an exploding chocolate and bit 6 a jelly square
+CHOCOLATE = 6
+EMPTY = 7
+STRIPED = 0x08
+HORIZONTAL = 0x10
+EXPLODING = 0x20
+JELLY = 0x40
+COLOR_MASK = 0x07
+CANDY_MASK = 0x3F
+
+# Byte translation tables over cell codes, and a run of 3+ same colored candies
+COLOR_PLANE = bytes([code & COLOR_MASK for code in range(256)])
+CANDY_PLANE = bytes([code & CANDY_MASK for code in range(256)])
+EMPTY_CANDY = bytes([EMPTY])
+EXPLODING_PLANE = bytes([1 if code & EXPLODING else 0 for code in range(256)])
+LEGAL_PLANE = bytes([code & (COLOR_MASK | STRIPED) for code in range(256)])
+RUN_RE = re.compile(rb'([\x00-\x05])\1\1+')
+
+# 0/1 planes for the AI heuristic, see heuristic_terms
+CHOCOLATE_PLANE = bytes([1 if code & COLOR_MASK == CHOCOLATE else 0 for code in range(256)])
+PLAIN_PLANE = bytes([1 if code & COLOR_MASK < CHOCOLATE and not code & STRIPED else 0 for code in range(256)])
+VERTICAL_PLANE = bytes([1 if code & COLOR_MASK < CHOCOLATE and code & STRIPED and not code & HORIZONTAL else 0 for code in range(256)])
+HORIZONTAL_PLANE = bytes([1 if code & COLOR_MASK < CHOCOLATE and code & STRIPED and code & HORIZONTAL else 0 for code in range(256)])
+COLOR_PLANES = [bytes([1 if code & COLOR_MASK == color else 0 for code in range(256)]) for color in range(CHOCOLATE)]
+SQUARE_PLANE = bytes([0 if code == 0xff else 1 for code in range(256)])
+MOVE_RE = re.compile(rb'[\x01-\x03]')
+
+# child is a (board, score) pair from generate_levels
+def avg_row(child):
+    return move_row(child[0].last_move)
+
+# Row a move ends up around, the first sort key for AIPlayer's children
+def move_row(lm):
     if lm[2] == GameBoard.MOVES[0]:
         return int(lm[0]-1)
     elif lm[2] == GameBoard.MOVES[1]:
@@ -20,26 +57,229 @@ def avg_row(anode):
     elif lm[2] == GameBoard.MOVES[2] or lm[2] == GameBoard.MOVES[3]:
         return int(lm[0])
 
-class Driver:
-    TYPE = ["human", "random", "ai"]
+# Process pool task for AIPlayer's parallel search: expand and score the
+# subtree below one root child, seeded so the result is reproducible
+def expand_subtree(depth_limit, beam_width, board, score, seed, search=None, objective=None):
+    random.seed(seed)
+    player = AIPlayer(depth_limit, beam_width, search=search, objective=objective)
+    if player.search == AIPlayer.SEARCH[1]:
+        score = player.expand_undo(board, score, 1, beam_width)
+        return score, player.max_score, player.nodes_expanded
+    player.gameTree = SearchTree(board, score)
+    player.expand_tree(0, 1, beam_width)
+    return player.gameTree.score[0], player.max_score, player.nodes_expanded
+
+# Hot path profiler, off unless start_profile is called
+# The functions in Profile.TIMED are swapped for timing wrappers only while it
+# runs, so they cost nothing when it is off; the cascade and search level
+# counters are a single PROFILE check each
+# Only this process is counted, not AIPlayer's search worker processes
+PROFILE = None
+PROFILED = []   # (class or None, name, original) swapped out by start_profile
+
+class Profile:
+    # "Class.method" or a module level function
+    TIMED = ["GameBoard.copyme", "ArrayGameBoard.copyme", "GameBoard.move", "GameBoard.legal_moves",
+             "GameBoard.check_match", "GameBoard.update_board", "ArrayGameBoard.update_board",
+             "GameBoard.crush_ranges", "ArrayGameBoard.crush_ranges", "GameBoard.crush_color",
+             "GameBoard.move_and_refill", "ArrayGameBoard.move_and_refill",
+             "GameBoard.shuffle",
+             "AIPlayer.generate_levels", "AIPlayer.h_func", "AIPlayer.h_func_batch", "AIPlayer.h_combine",
+             "AIPlayer.sort_children", "heuristic_terms", "jelly_terms", "batch_legal_moves"]
 
-    def __init__(self, seed):
+    def __init__(self):
+        self.calls = {}
+        self.times = {} # Seconds, counting only the outermost of recursive calls
+        self.active = {}
+        for name in Profile.TIMED:
+            self.calls[name] = 0
+            self.times[name] = 0
+            self.active[name] = 0
+        self.cascades = {}  # Cascade depth -> moves
+        self.crushes = [0, 0, 0]    # Cascade waves, squares cleared, specials set off
+        self.shuffles = {}  # Retries -> shuffles, see GameBoard.shuffle
+        self.levels = {}    # Search level -> [nodes expanded, children generated, children kept]
+
+    def timed(self, name, func):
+        calls = self.calls
+        times = self.times
+        active = self.active
+        def wrapper(*args, **kwargs):
+            calls[name] = calls[name] + 1
+            if active[name] > 0:
+                return func(*args, **kwargs)
+            active[name] = 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[name] = times[name] + time.perf_counter() - start
+                active[name] = 0
+        return wrapper
+
+    # A move resolved in depth waves, clearing cells squares and setting off specials
+    def add_cascade(self, depth, cells, specials):
+        self.cascades[depth] = self.cascades.get(depth, 0) + 1
+        self.crushes[0] = self.crushes[0] + depth
+        self.crushes[1] = self.crushes[1] + cells
+        self.crushes[2] = self.crushes[2] + specials
+
+    # A shuffle needed retries placements before the board had a valid move
+    def add_shuffle(self, retries):
+        self.shuffles[retries] = self.shuffles.get(retries, 0) + 1
+
+    # A search node at level was expanded: generated children, kept after the beam
+    def add_level(self, level, generated, kept):
+        if level not in self.levels:
+            self.levels[level] = [0, 0, 0]
+        counts = self.levels[level]
+        counts[0] = counts[0] + 1
+        counts[1] = counts[1] + generated
+        counts[2] = counts[2] + kept
+
+    # Fold in another Profile, e.g. one from a game worker
+    def merge(self, other):
+        for name in other.calls:
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+            self.times[name] = self.times.get(name, 0) + other.times[name]
+        for depth in other.cascades:
+            self.cascades[depth] = self.cascades.get(depth, 0) + other.cascades[depth]
+        for i in range(3):
+            self.crushes[i] = self.crushes[i] + other.crushes[i]
+        for retries in other.shuffles:
+            self.shuffles[retries] = self.shuffles.get(retries, 0) + other.shuffles[retries]
+        for level in other.levels:
+            if level not in self.levels:
+                self.levels[level] = [0, 0, 0]
+            for i in range(3):
+                self.levels[level][i] = self.levels[level][i] + other.levels[level][i]
+
+    # Plain dict of everything counted, ready for json.dump
+    # Branching is children generated per node expanded (valid moves), effective
+    # branching the children kept per node expanded after the beam cut
+    def report(self):
+        functions = {}
+        for name in Profile.TIMED:
+            if self.calls.get(name, 0) > 0:
+                functions[name] = {"calls":self.calls[name], "time":self.times[name]}
+        levels = {}
+        expanded = 0
+        generated = 0
+        kept = 0
+        for level in sorted(self.levels):
+            counts = self.levels[level]
+            levels[str(level)] = {"expanded":counts[0], "generated":counts[1], "kept":counts[2],
+                                  "branching":counts[1]/counts[0], "effective_branching":counts[2]/counts[0]}
+            expanded = expanded + counts[0]
+            generated = generated + counts[1]
+            kept = kept + counts[2]
+        cascades = {}
+        for depth in sorted(self.cascades):
+            cascades[str(depth)] = self.cascades[depth]
+        shuffles = {}
+        for retries in sorted(self.shuffles):
+            shuffles[str(retries)] = self.shuffles[retries]
+        waves, cells, specials = self.crushes
+        return {"functions":functions,
+                "cascade_depth":cascades,
+                "cascades":{"waves":waves, "cells_cleared":cells, "specials_triggered":specials,
+                            "cells_per_wave":cells/waves if waves > 0 else 0},
+                "shuffle_retries":shuffles,
+                "levels":levels,
+                "branching":generated/expanded if expanded > 0 else 0,
+                "effective_branching":kept/expanded if expanded > 0 else 0}
+
+# Start counting into a new Profile, which is returned
+def start_profile():
+    global PROFILE
+    if PROFILE != None:
+        print("ERROR: Already profiling")
+        raise Exception("Already profiling")
+    PROFILE = Profile()
+    for target in Profile.TIMED:
+        if "." in target:
+            owner = globals()[target.split(".")[0]]
+            name = target.split(".")[1]
+            original = owner.__dict__[name]
+            setattr(owner, name, PROFILE.timed(target, original))
+        else:
+            owner = None
+            name = target
+            original = globals()[name]
+            globals()[name] = PROFILE.timed(target, original)
+        PROFILED.append((owner, name, original))
+    return PROFILE
+
+# Put the original functions back; returns the Profile that was running
+def stop_profile():
+    global PROFILE
+    for owner, name, original in PROFILED:
+        if owner == None:
+            globals()[name] = original
+        else:
+            setattr(owner, name, original)
+    del PROFILED[:]
+    profile = PROFILE
+    PROFILE = None
+    return profile
+
+class Driver:
+    TYPE = ["human", "random", "ai", "mcts"]
+    ENGINE = ["object", "array", "array+wave"]
+    # "shared": boards draw from the random module, like the players do
+    # "board": each board draws from its own SplitMix64 seeded from the seed,
+    # and board copies fork it, so searching never moves the game's stream
+    # "known": the board's own stream plus known refills (RefillStreams);
+    # copies draw exactly what the board will, so a search sees real outcomes
+    RNG = ["shared", "board", "known"]
+
+    def __init__(self, seed, rng=None):
         self.gameBoards = []
         self.players = []
+        self.seed = seed
+        if rng == None:
+            self.rng = Driver.RNG[0]
+        elif rng in Driver.RNG:
+            self.rng = rng
+        else:
+            print("ERROR: Invalid rng: "+str(rng))
+            raise Exception("Invalid rng: "+str(rng))
         random.seed(seed)
 
     # Create new GameBoard
-    def append_game(self, rows, cols, mode):
-        self.gameBoards.append(GameBoard(rows, cols, mode))
+    # Engine selects the board representation; both play identical games for a seed
+    def append_game(self, rows, cols, mode, engine=None):
+        if engine == None or engine == Driver.ENGINE[0]:
+            self.gameBoards.append(GameBoard(rows, cols, mode))
+        elif engine == Driver.ENGINE[1]:
+            self.gameBoards.append(ArrayGameBoard(rows, cols, mode))
+        elif engine == Driver.ENGINE[2]:
+            self.gameBoards.append(ArrayGameBoard(rows, cols, mode, ArrayGameBoard.CASCADE[1]))
+        else:
+            print("Invalid engine: "+str(engine))
+            raise Exception("Invalid engine: "+str(engine))
+        init_rng(self.gameBoards[-1], self.rng, self.seed, len(self.gameBoards)-1)
 
     # Create new Player
-    def append_player(self, playerType, depth_limit=None, beam_width=None):
+    # Workers > 1 lets the AI player search the root's subtrees in parallel
+    # Table size > 0 gives the AI player a transposition table of that many states
+    # (rng "board" or "known" only, see TranspositionTable)
+    # Search picks how the AI player walks its tree, see AIPlayer.SEARCH
+    # Time limit is seconds per move for the AI and MCTS players, rollouts the
+    # MCTS player's other budget
+    # Reuse tree lets the AI player keep the played move's subtree, see AIPlayer.init_tree
+    # Objective is what the AI player's heuristic goes for, see AIPlayer.OBJECTIVE
+    def append_player(self, playerType, depth_limit=None, beam_width=None, workers=None, table_size=None, search=None,
+            rollouts=None, time_limit=None, reuse_tree=False, objective=None, rollout_depth=None):
         if playerType == Driver.TYPE[0]:
             self.players.append(HumanPlayer())
         elif playerType == Driver.TYPE[1]:
             self.players.append(RandomPlayer())
         elif playerType == Driver.TYPE[2]:
-            self.players.append(AIPlayer(depth_limit,beam_width))
+            self.players.append(AIPlayer(depth_limit,beam_width,workers,self.seed,table_size,search,time_limit,reuse_tree,
+                    objective))
+        elif playerType == Driver.TYPE[3]:
+            self.players.append(MCTSPlayer(rollouts,time_limit,None,rollout_depth))
         else:
             print("Shtop it")
             raise Exception("Shtop it")
@@ -55,6 +295,9 @@ class Player(object):
 
     def __init__(self):
         self.gameBoard = None   # Player is assigned its GameBoard
+        self.move_log = None    # List to append a record of each move to, if any
+        self.nodes_expanded = 0 # Search nodes expanded so far
+        self.depth_reached = 0  # Levels searched below the board on the last move
 
     def init_board(self, game_board):
         self.gameBoard = game_board
@@ -73,7 +316,11 @@ class Player(object):
         while self.gameBoard.finish == False:
             #print()
             #self.gameBoard.print_board()
-            self.next_move()
+            if self.move_log == None:
+                self.next_move()
+            else:
+                self.logged_move()
+        self.close()
 
         # Get info after game is finished
         #self.gameBoard.print_board()
@@ -83,6 +330,25 @@ class Player(object):
     def next_move(self):
         return
 
+    # next_move, then append what it did to move_log
+    def logged_move(self):
+        score = self.gameBoard.score
+        nodes = self.nodes_expanded
+        start = time.time()
+        self.next_move()
+        self.move_log.append({"move":self.gameBoard.move_counter,
+                              "score_delta":self.gameBoard.score-score,
+                              "cascade_depth":self.gameBoard.cascade_depth,
+                              "cells_cleared":self.gameBoard.cells_cleared,
+                              "specials":self.gameBoard.specials_triggered,
+                              "nodes":self.nodes_expanded-nodes,
+                              "depth":self.depth_reached,
+                              "time":time.time()-start})
+
+    # Release anything held for the game (e.g. worker processes)
+    def close(self):
+        return
+
 class HumanPlayer(Player):
     def __init__(self):
         super().__init__()
@@ -104,21 +370,81 @@ class HumanPlayer(Player):
                 print("Exception: "+str(e))
 
 class AIPlayer(Player):
-    def __init__(self, depth_limit, beam_width):
+    # "tree" keeps a board copy in every node, "undo" walks the tree depth-first
+    # on one board and takes each move back (GameBoard.make_move/unmake_move)
+    SEARCH = ["tree", "undo"]
+    # "score" is the original heuristic, "jelly" adds the jelly a move clears
+    # (see jelly_terms); with no objective given, boards in a jelly mode get "jelly"
+    OBJECTIVE = ["score", "jelly"]
+
+    # With a time limit (seconds per move) the tree deepens a level at a time
+    # until time is up, to depth_limit at most (None for no limit)
+    # Reuse tree keeps the played move's subtree for the next move, see init_tree
+    def __init__(self, depth_limit, beam_width, workers=None, seed=None, table_size=None, search=None, time_limit=None,
+            reuse_tree=False, objective=None):
         super().__init__()
+        # Nothing else stops the search in a game that never runs out of moves
+        if depth_limit == None and time_limit == None:
+            print("ERROR: Need a depth limit or a time limit")
+            raise ValueError("Need a depth limit or a time limit")
+        if objective != None and objective not in AIPlayer.OBJECTIVE:
+            print("ERROR: Invalid objective: "+str(objective))
+            raise Exception("Invalid objective: "+str(objective))
+        self.objective = objective
+        if search == None:
+            self.search = AIPlayer.SEARCH[0]
+        elif search in AIPlayer.SEARCH:
+            self.search = search
+        else:
+            print("ERROR: Invalid search: "+str(search))
+            raise Exception("Invalid search: "+str(search))
+        self.time_limit = time_limit
+        if time_limit != None and (self.search != AIPlayer.SEARCH[0] or (workers != None and workers > 1)):
+            print("ERROR: A time limit needs the tree search on one worker")
+            raise Exception("A time limit needs the tree search on one worker")
+        self.reuse_tree = reuse_tree
+        if reuse_tree == True and (self.search != AIPlayer.SEARCH[0] or (workers != None and workers > 1)):
+            print("ERROR: Reusing the tree needs the tree search on one worker")
+            raise Exception("Reusing the tree needs the tree search on one worker")
+        self.tree_hits = 0  # Moves that started from the previous move's subtree
+        self.tree_misses = 0
         self.depth_limit = depth_limit
         self.beam_width = beam_width    # Percentage of top nodes to expand
-        self.gameTree = None
-        self.best_node = None  # Best pick for next move
-        self.stored_states = {}   # Hash to store all previously seen states
-        self.hash_hits = 0
+        self.workers = workers if workers != None else 1   # Processes for the search
+        self.seed = seed    # Driver seed, makes parallel searches reproducible
+        self.pool = None
+        self.gameTree = None    # SearchTree of the move being searched
+        self.reused = None  # (last move's tree, {node: its node there}) on a reuse hit, see init_tree
+        self.best_node = None  # Best pick for next move, a node of gameTree
+        self.stored_states = None   # Previously expanded states, see TranspositionTable
+        if table_size != None and table_size > 0:
+            self.stored_states = TranspositionTable(table_size)
         self.num_children = 0
+        self.total_depth = 0    # Sum of depth_reached over the moves played
         self.max_score = 0
 
         #print("Starting AI (depth_limit,beam_width): "+str(depth_limit)+","+str(beam_width))
+
+    # No transposition table on the shared stream, see TranspositionTable
+    def init_board(self, game_board):
+        super().init_board(game_board)
+        if game_board.rng == random:
+            self.stored_states = None
     
+    # With reuse_tree, the last move's tree is kept if the board came out of
+    # the move the way the played child predicted; refills that differ show
+    # up as a different hash and the tree is built anew. The new root is still
+    # expanded at the full beam (the child was cut to a narrower one), and
+    # nodes below it that come out the same reuse what they can, see expand_node
     def init_tree(self):
-        self.gameTree = Node(self.gameBoard,0)
+        self.reused = None
+        if self.reuse_tree == True and self.best_node != None:
+            if same_outcome(self.gameTree.obj[self.best_node], self.gameBoard):
+                self.tree_hits = self.tree_hits + 1
+                self.reused = (self.gameTree, {0: self.best_node})
+            else:
+                self.tree_misses = self.tree_misses + 1
+        self.gameTree = SearchTree(self.gameBoard,0)
     
     # Smart AI Player
     def next_move(self):
@@ -133,357 +459,767 @@ class AIPlayer(Player):
         self.max_score = 0
 
         # Generate and build our game tree
-        full_node_list = [self.gameTree]
-        curr_node_list = [self.gameTree]
-        curr_level = 0
-        beam_width = self.beam_width
-        while curr_level <= self.depth_limit and len(curr_node_list) > 0:
-            children = []
-            if curr_level == self.depth_limit:
-                full_node_list.extend(curr_node_list)
-                break
-            for i in range(len(curr_node_list)):
-                self.generate_levels(curr_node_list[i], curr_level, beam_width)
-                children.extend(curr_node_list[i].children)
-                full_node_list.append(curr_node_list[i])
-            curr_node_list = []
-            curr_node_list.extend(children)
-            beam_width = int(math.sqrt(beam_width))
-            curr_level = curr_level + 1
-
-        # Go from bottom-up to find average scores
-        for i in range(len(full_node_list)-1,-1,-1):
-            full_node_list[i].find_avg_score()
+        if self.time_limit != None:
+            self.expand_tree(0, 0, self.beam_width, time.time()+self.time_limit)
+        elif self.workers > 1:
+            self.expand_parallel()
+            self.depth_reached = self.depth_limit
+        elif self.search == AIPlayer.SEARCH[1]:
+            self.expand_root_undo()
+            self.depth_reached = self.depth_limit
+        else:
+            self.expand_tree(0, 0, self.beam_width)
 
-        self.num_children = self.num_children + len(self.gameTree.children)
+        tree = self.gameTree
+        self.num_children = self.num_children + tree.count[0]
+        self.total_depth = self.total_depth + self.depth_reached
 
         # Take path with highest average heuristic cost
-        for i in self.gameTree.children:
+        for i in tree.children(0):
             #print("A child")
-            #i.obj.print_board()
-            #print("Last move: "+str(i.obj.last_move))
-            #print("Score: "+str(i.score))
+            #tree.obj[i].print_board()
+            #print("Last move: "+str(tree.obj[i].last_move))
+            #print("Score: "+str(tree.score[i]))
             if self.best_node == None:
                 self.best_node = i
-            elif i.score >= self.best_node.score:
+            elif tree.score[i] >= tree.score[self.best_node]:
                 self.best_node = i
 
-        #print("Best node last move is: "+str(self.best_node.obj.last_move))
-        #print("Best node score is: "+str(self.best_node.obj.score))
+        #print("Best node last move is: "+str(tree.obj[self.best_node].last_move))
+        #print("Best node score is: "+str(tree.obj[self.best_node].score))
         #print("Max score: "+str(self.max_score))
 
-        next_move = self.best_node.obj.last_move
+        if tree.obj[self.best_node] != None:
+            next_move = tree.obj[self.best_node].last_move
+        else:
+            next_move = tree.move[self.best_node]
         self.gameBoard.move(next_move[0],next_move[1],next_move[2])
         #print("Current score: "+str(self.gameBoard.score))
         #print("Did move #: "+str(self.gameBoard.move_counter))
 
+    # Build the tree below node level by level; each level keeps a narrower beam
+    # Then go from bottom-up to find average scores
+    # Past the deadline (a time.time() value) no new level is started, and a
+    # level left unfinished is dropped so every child is scored to the same depth;
+    # the first level is always built
+    def expand_tree(self, node, level, beam_width, deadline=None):
+        tree = self.gameTree
+        full_node_list = []
+        curr_node_list = [node]
+        curr_level = level
+        self.depth_reached = 0
+        while (self.depth_limit == None or curr_level <= self.depth_limit) and len(curr_node_list) > 0:
+            children = []
+            if curr_level == self.depth_limit:
+                full_node_list.extend(curr_node_list)
+                break
+            finished = True
+            mark = len(tree)
+            for i in range(len(curr_node_list)):
+                if deadline != None and curr_level > level and time.time() >= deadline:
+                    finished = False
+                    break
+                self.expand_node(curr_node_list[i], curr_level, beam_width)
+                children.extend(tree.children(curr_node_list[i]))
+                full_node_list.append(curr_node_list[i])
+            if finished == False:
+                for i in curr_node_list:
+                    tree.count[i] = 0
+                tree.truncate(mark)
+                if self.reused != None:
+                    for i in [i for i in self.reused[1] if i >= mark]:
+                        del self.reused[1][i]
+                break
+            self.depth_reached = curr_level+1-level
+            curr_node_list = []
+            curr_node_list.extend(children)
+            beam_width = int(math.sqrt(beam_width))
+            curr_level = curr_level + 1
+
+        for i in range(len(full_node_list)-1,-1,-1):
+            tree.find_avg_score(full_node_list[i])
+
+    # generate_levels, except that a node standing for one of the last move's
+    # tree (reuse_tree) takes its children from there when that node kept all
+    # of its moves or at least beam_width of them (children are kept best
+    # first); children that come out the same then stand for their old nodes
+    def expand_node(self, node, level, beam_width):
+        tree = self.gameTree
+        if self.reused == None or node not in self.reused[1]:
+            self.generate_levels(node, level, beam_width)
+            return
+        old, nodes = self.reused
+        old_node = nodes[node]
+        count = old.count[old_node]
+        if count > 0 and (count >= beam_width or count < old.width[old_node]):
+            old_children = old.children(old_node)[:beam_width]
+            tree.add_children(node, [(old.obj[c], old.h_score[c]) for c in old_children])
+            tree.width[node] = beam_width
+        else:
+            self.generate_levels(node, level, beam_width)
+            old_children = old.children(old_node)
+        by_move = {}
+        for c in old_children:
+            by_move[old.obj[c].last_move] = c
+        for child in tree.children(node):
+            c = by_move.get(tree.obj[child].last_move)
+            if c != None and same_outcome(old.obj[c], tree.obj[child]):
+                nodes[child] = c
+
+    # Expand the root here, then farm each root child's subtree out to the pool
+    # Every subtree is seeded from (Driver seed, move, child) so the result does
+    # not depend on the number of workers
+    def expand_parallel(self):
+        tree = self.gameTree
+        self.generate_levels(0, 0, self.beam_width)
+        children = tree.children(0)
+        if self.depth_limit > 1:
+            if self.pool == None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            beam_width = int(math.sqrt(self.beam_width))
+            futures = []
+            for i in range(len(children)):
+                child = children[i]
+                seed = str(self.seed)+":"+str(self.gameBoard.move_counter)+":"+str(i)
+                futures.append(self.pool.submit(expand_subtree, self.depth_limit,
+                        beam_width, tree.obj[child], tree.score[child], seed, self.search, self.objective))
+            for i in range(len(futures)):
+                score, max_score, nodes = futures[i].result()
+                self.nodes_expanded = self.nodes_expanded + nodes
+                tree.score[children[i]] = score
+                if max_score > self.max_score:
+                    self.max_score = max_score
+        tree.find_avg_score(0)
+
+    # Undo search from the root: only the root's children become tree nodes (with
+    # no board, just their move), everything below is scored on the way back up
+    # The search draws from its own stream seeded like expand_parallel's subtrees,
+    # so taking moves back never hands it the refills the real move will get
+    def expand_root_undo(self):
+        board = self.gameBoard
+        # A shuffle at the root is part of the game, not the search
+        while len(board.legal_moves()) == 0:
+            board.shuffle()
+        state = random.getstate()
+        random.seed(str(self.seed)+":"+str(board.move_counter))
+        # A board with its own stream searches on a fork of it
+        rng = board.rng
+        board.rng = board.search_rng()
+        children = self.undo_children(board, 0, self.beam_width)
+        beam_width = int(math.sqrt(self.beam_width))
+        tree = self.gameTree
+        tree.add_children(0, [(None, h_val) for move, h_val in children])
+        for child, (move, h_val) in zip(tree.children(0), children):
+            tree.move[child] = move
+            if self.depth_limit > 1:
+                board.make_move(move[0],move[1],move[2])
+                tree.score[child] = self.expand_undo(board, h_val, 1, beam_width)
+                board.unmake_move()
+        tree.find_avg_score(0)
+        board.rng = rng
+        random.setstate(state)
+
+    # Score of the node holding board at level, as expand_tree would leave it;
+    # board is back in the same state on return
+    def expand_undo(self, board, score, level, beam_width):
+        if level >= self.depth_limit:
+            return score
+        if board.out_of_moves():
+            if board.score > self.max_score:
+                self.max_score = board.score
+            return score
+        # No valid moves, we must shuffle
+        shuffled = False
+        while len(board.legal_moves()) == 0:
+            if not shuffled:
+                board.push_journal()
+                shuffled = True
+            board.shuffle()
+        children = self.undo_children(board, level, beam_width)
+        beam_width = int(math.sqrt(beam_width))
+        children_score = 0
+        for move, h_val in children:
+            board.make_move(move[0],move[1],move[2])
+            children_score = children_score + self.expand_undo(board, h_val, level+1, beam_width)
+            board.unmake_move()
+        if shuffled:
+            board.pop_journal()
+        # Same as SearchTree.find_avg_score
+        if len(children) > 0:
+            score = (score+children_score/len(children))/2.0
+        return score
+
+    # (move, h_val) for the children generate_levels would keep, best first
+    # Each move is made, scored and taken back again, random stream included,
+    # so making a kept move again gives the same child
+    def undo_children(self, board, level, beam_width):
+        children = []
+        self.nodes_expanded = self.nodes_expanded + 1
+        parent_score = board.score
+        parent_jelly = board.jelly_mask
+        jelly = self.plays_jelly(board)
+        for move in board.legal_moves():
+            board.make_move(move[0],move[1],move[2])
+            if board.out_of_moves():
+                h_val = board.score
+            else:
+                terms = heuristic_terms([board], board.rows, board.cols)[0]
+                h_val = self.h_combine(board, terms, parent_score)
+            if jelly:
+                h_val = h_val + self.h_jelly(board, parent_jelly)
+            children.append((move, h_val))
+            board.unmake_move()
+        self.sort_children(children, lambda child: move_row(child[0]))
+        if PROFILE != None:
+            PROFILE.add_level(level, len(children), len(children[:beam_width]))
+        # Keep top % indicated by beam width
+        return children[:beam_width]
+
+    def close(self):
+        if self.pool != None:
+            self.pool.shutdown()
+            self.pool = None
+
+    # Children of gameTree's node, as (board, score) pairs until the kept ones
+    # are added to the tree
     def generate_levels(self, node, level, beam_width):
+        tree = self.gameTree
+        board = tree.obj[node]
         children = []   # Potential children of this node
-        use_hashing = False
+        key = None
 
-        if node.obj.move_counter >= node.obj.goal_value["moves"]:
-            if node.obj.score > self.max_score:
-                self.max_score = node.obj.score
+        if board.out_of_moves():
+            if board.score > self.max_score:
+                self.max_score = board.score
             return
 
         # Continue until we have at least one valid move
         while len(children) == 0:
-            if use_hashing == True and node.obj.hash_key() in self.stored_states:
-                children = self.stored_states[node.obj.hash_key()]
-                self.hash_hits = self.hash_hits + 1
-                break
-            # Create the next level of tree
-            for row in range(node.obj.rows):
-                for col in range(node.obj.cols):
-                    # For each candy, move right and down
-                    try:
-                        new_board = node.obj.copyme()
-                        new_board.move(row,col,GameBoard.MOVES[3])
-                        children.append(Node(new_board,self.h_func(node.obj,new_board,level+1),level+1))
-                    except RuntimeError as e:
-                        pass
-                        #print("Exception: "+str(e))
-                    try:
-                        new_board = node.obj.copyme()
-                        new_board.move(row,col,GameBoard.MOVES[1])
-                        children.append(Node(new_board,self.h_func(node.obj,new_board,level+1),level+1))
-                    except RuntimeError as e:
-                        pass
-                        #print("Exception: "+str(e))
+            if self.stored_states != None:
+                key = self.stored_states.key(board)
+                entry = self.stored_states.get(key)
+                if entry != None:
+                    # Already sorted
+                    tree.add_children(node, entry[:beam_width])
+                    tree.width[node] = beam_width
+                    if PROFILE != None:
+                        PROFILE.add_level(level, len(entry), tree.count[node])
+                    return
+            # Create the next level of tree, one child per valid move
+            self.nodes_expanded = self.nodes_expanded + 1
+            boards = []
+            for move in board.legal_moves():
+                new_board = board.copyme()
+                new_board.move(move[0],move[1],move[2])
+                boards.append(new_board)
+            h_vals = self.h_func_batch(board, boards, level+1)
+            for i in range(len(boards)):
+                children.append((boards[i],h_vals[i]))
             # No valid moves, we must shuffle
             if len(children) == 0:
-                node.obj.shuffle()
+                # Boards below the root may also sit in the transposition table
+                # copyme leaves last_move behind, which next_move still needs
+                if tree.parent[node] != -1:
+                    last_move = board.last_move
+                    board = board.copyme()
+                    board.last_move = last_move
+                    tree.obj[node] = board
+                board.shuffle()
 
-        # First sort by average position in the board
-        children.sort(key=avg_row, reverse=True)
-        # Sort children on score, keep top % indicated by beam width
-        children.sort(key=lambda child: child.score, reverse=True)
+        self.sort_children(children, avg_row)
 
-        if use_hashing == True and node.obj.hash_key() not in self.stored_states:
-            # Add new state to hash
-            self.stored_states[node.obj.hash_key()] = children
+        if self.stored_states != None:
+            # Add new state to the table
+            self.stored_states.put(key, children)
 
         #print("# Children(generate_levels): "+str(len(children)))
+        # Keep top % indicated by beam width
         final_children = children[:beam_width]
         #print("# Final Children(generate_levels): "+str(len(children)))
-        node.add_children(final_children)
-        #print("# Children Node: "+str(len(node.children)))
+        tree.add_children(node, final_children)
+        tree.width[node] = beam_width
+        if PROFILE != None:
+            PROFILE.add_level(level, len(children), len(final_children))
+        #print("# Children Node: "+str(tree.count[node]))
+
+    # (move or board, score) pairs, best first: by score, then by the row the
+    # move ends up around (row_key)
+    def sort_children(self, children, row_key):
+        children.sort(key=row_key, reverse=True)
+        children.sort(key=lambda child: child[1], reverse=True)
 
     def h_func_simple(self, parent_state, child_state, level):
         return (child_state.score/child_state.move_counter)
 
     # Determines the heuristic goodness score for a subsequent game board state
     def h_func(self, parent_state, child_state, level):
-        score_diff = child_state.score - parent_state.score
-        pair_striped = 0
-        pair_choco = 0
-        choco_nearby = {} # Ex. {Chocolate:[Candy,StripedCandy,Chocolate,...,]}
-        candy_nearby = 0    # Counts identical color candy nearby
-        color_count = {} # Ex. {'G':1,'R':2}
-        striped_dict = {} # Ex. {'G':1,'R':0}
-        h_val = 0
-
-        # If this is the last move, just look at max score
-        if child_state.move_counter >= child_state.goal_value["moves"]:
-            return child_state.score
-
-        for i in Candy.COLORS:
-            color_count[i] = 0
- 
-        for row in range(len(self.gameBoard.squares)):
-            for col in range(len(self.gameBoard.squares[row])):
-                candy = child_state.squares[row][col].candy
-                if isinstance(candy, Chocolate):
-                    if candy not in choco_nearby:
-                        choco_nearby[candy] = []
-                    try:
-                        candy_right = child_state.squares[row][col+1].candy
-                        if isinstance(candy_right, Chocolate):
-                            pair_choco = pair_choco + 1
-                            # Avoid double counting
-                            choco_nearby[candy] = None
-                            choco_nearby[candy_right] = None
-                        elif isinstance(candy_right, Candy):
-                            if choco_nearby[candy] != None:
-                                choco_nearby[candy].append(candy_right)
-                    except IndexError as e:
-                        pass
-                    try:
-                        candy_down = child_state.squares[row+1][col].candy
-                        if isinstance(candy_down, Chocolate):
-                            pair_choco = pair_choco + 1
-                            # Avoid double counting
-                            choco_nearby[candy] = None
-                            choco_nearby[candy_down] = None
-                        elif isinstance(candy_down, Candy):
-                            if choco_nearby[candy] != None:
-                                choco_nearby[candy].append(candy_down)
-                    except IndexError as e:
-                        pass
-                elif isinstance(candy, StripedCandy):
-                    color_count[candy.color] = color_count[candy.color] + 1
-                    try:
-                        candy_right = child_state.squares[row][col+1].candy
-                        if isinstance(candy_right, Chocolate):
-                            if candy_right not in choco_nearby:
-                                choco_nearby[candy_right] = [candy]
-                            elif choco_nearby[candy_right] != None:
-                                choco_nearby[candy_right].append(candy)
-                        elif isinstance(candy_right, StripedCandy):
-                            pair_striped = pair_striped + 1
-                        elif candy.color == candy_right.color:
-                            if candy.direction == StripedCandy.DIR[0]:
-                                # Striped candy next to a same colored candy is worth more
-                                candy_nearby = candy_nearby + (child_state.rows/3.0)
-                            else:
-                                candy_nearby = candy_nearby + (child_state.cols/3.0)
-                    except IndexError as e:
-                        pass
-                    try:
-                        candy_down = child_state.squares[row+1][col].candy
-                        if isinstance(candy_down, Chocolate):
-                            if candy_down not in choco_nearby:
-                                choco_nearby[candy_down] = [candy]
-                            elif choco_nearby[candy_down] != None:
-                                choco_nearby[candy_down].append(candy)
-                        elif isinstance(candy_down, StripedCandy):
-                            pair_striped = pair_striped + 1
-                        elif candy.color == candy_down.color:
-                            if candy.direction == StripedCandy.DIR[0]:
-                                # Striped candy next to a same colored candy is worth more
-                                candy_nearby = candy_nearby + (child_state.rows/3.0)
-                            else:
-                                candy_nearby = candy_nearby + (child_state.cols/3.0)
-                    except IndexError as e:
-                        pass
-                else:
-                    color_count[candy.color] = color_count[candy.color] + 1
-                    try:
-                        candy_right = child_state.squares[row][col+1].candy
-                        if isinstance(candy_right, Chocolate):
-                            if candy_right not in choco_nearby:
-                                choco_nearby[candy_right] = [candy]
-                            elif choco_nearby[candy_right] != None:
-                                choco_nearby[candy_right].append(candy)
-                        elif candy.color == candy_right.color:
-                            if isinstance(candy_right, StripedCandy):
-                                if candy_right.direction == StripedCandy.DIR[0]:
-                                    # Striped candy next to a same colored candy is worth more
-                                    candy_nearby = candy_nearby + (child_state.rows/3.0)
-                                else:
-                                    candy_nearby = candy_nearby + (child_state.cols/3.0)
-                            else:
-                                candy_nearby = candy_nearby + 1
-                    except IndexError as e:
-                        pass
-                    try:
-                        candy_down = child_state.squares[row+1][col].candy
-                        if isinstance(candy_down, Chocolate):
-                            if candy_down not in choco_nearby:
-                                choco_nearby[candy_down] = [candy]
-                            elif choco_nearby[candy_down] != None:
-                                choco_nearby[candy_down].append(candy)
-                        elif candy.color == candy_down.color:
-                            if isinstance(candy_down, StripedCandy):
-                                if candy_down.direction == StripedCandy.DIR[0]:
-                                    # Striped candy next to a same colored candy is worth more
-                                    candy_nearby = candy_nearby + (child_state.rows/3.0)
-                                else:
-                                    candy_nearby = candy_nearby + (child_state.cols/3.0)
-                            else:
-                                candy_nearby = candy_nearby + 1
-                    except IndexError as e:
-                        pass
-
+        return self.h_func_batch(parent_state, [child_state], level)[0]
+
+    # h_func for all children of one parent in a single pass, see heuristic_terms
+    def h_func_batch(self, parent_state, child_states, level):
+        h_vals = []
+        if len(child_states) == 0:
+            return h_vals
+        terms = heuristic_terms(child_states, parent_state.rows, parent_state.cols)
+        jelly = self.plays_jelly(parent_state)
+        for k in range(len(child_states)):
+            child_state = child_states[k]
+            # If this is the last move, just look at max score
+            if child_state.out_of_moves():
+                h_val = child_state.score
+            else:
+                h_val = self.h_combine(child_state, terms[k], parent_state.score)
+            if jelly:
+                h_val = h_val + self.h_jelly(child_state, parent_state.jelly_mask)
+            h_vals.append(h_val)
+        return h_vals
+
+    # h_func from a child's heuristic_terms and its parent's score
+    def h_combine(self, child_state, terms, parent_score):
+        rows = child_state.rows
+        cols = child_state.cols
+        pair_striped, pair_choco, candy_nearby, choco_val = terms
         # Add in score for each paired striped candy
-        h_val = h_val + (pair_striped*(child_state.rows+child_state.cols))
-
+        h_val = pair_striped*(rows+cols)
         # Add in score for each chocolate (unpaired)
-        # Find greatest score
-        for i in choco_nearby:
-            if choco_nearby[i] == None:
-                continue
-            max_val = 0
-            for j in choco_nearby[i]:
-                if isinstance(j, StripedCandy):
-                    temp = color_count[j.color]
-                    val = 0
-                    # Assign random directions to new striped candies
-                    for k in range(temp):
-                        sdir = random.choice(['up','down'])
-                        if sdir == 'up':
-                            val = val + child_state.rows
-                        else:
-                            val = val + child_state.cols
-                    if val > max_val:
-                        max_val = val
-                else:
-                    temp = color_count[j.color]
-                    if temp > max_val:
-                        max_val = temp
-            # Add one for chocolate
-            h_val = h_val + max_val + 1
-
+        h_val = h_val + choco_val
         # Add in score for each paired chocolate
-        h_val = h_val + (pair_choco*(child_state.rows*child_state.cols))
-
+        h_val = h_val + (pair_choco*(rows*cols))
         # Add in score for candy color in proximity to one another
         h_val = h_val + candy_nearby
-
-        #print("h_val: "+str(h_val))
-        #print("score_diff: "+str(score_diff))
-        #print("diff : "+str(parent_state.state_compare_diff(child_state)))
-
         # Difference in score between parent and child state
-        h_val = h_val + (score_diff)
-
-        #diff = parent_state.state_compare_diff(child_state)
-
-        #if score_diff >= diff:
-            #h_val = h_val * ((score_diff-diff)/len(Candy.COLORS))
-        #else:
-            #h_val = h_val * (1.0/((diff-score_diff)*len(Candy.COLORS)))
-
-        #print("***Parent***")
-        #parent_state.print_board()
-        #print("Move: "+str(child_state.last_move))
-        #print("***Child***")
-        #print("pair_striped: "+str(pair_striped))
-        #print("pair_choco: "+str(pair_choco))
-        #print("candy_nearby: "+str(candy_nearby))
-        #print("score_diff: "+str(score_diff))
-        #print("h_val: "+str(h_val))
-        #child_state.print_board()
+        h_val = h_val + (child_state.score - parent_score)
+        return h_val
+
+    def plays_jelly(self, board):
+        if self.objective == None:
+            return board.mode == GameBoard.MODE[2] or board.mode == GameBoard.MODE[3]
+        return self.objective == AIPlayer.OBJECTIVE[1]
+
+    # Jelly part of h_func, from the parent's jelly_mask
+    def h_jelly(self, child_state, parent_jelly):
+        cleared, reach = jelly_terms(child_state, parent_jelly)
+        # Each jelly square cleared is worth as much as a paired chocolate
+        h_val = cleared*(child_state.rows*child_state.cols)
+        # Add in score for jelly a striped candy will clear when crushed
+        h_val = h_val + reach
         return h_val
 
 class RandomPlayer(Player):
     def __init__(self):
         super().__init__()
     
-    # Totally random Player
+    # Totally random Player, picks uniformly among the valid moves
     def next_move(self):
-        moves = []
-        while True:
-            if len(moves) == 0:
-                for row in range(len(self.gameBoard.squares)):
-                    for col in range(len(self.gameBoard.squares[row])):
-                        moves.append((row,col,"r"))
-                        moves.append((row,col,"d"))
-            try:
-                move_idx = random.randrange(len(moves))
-                move = moves[move_idx]
-                moves.pop(move_idx)
-                self.gameBoard.move(move[0],move[1], move[2])
-                break
-            except RuntimeError as e:
-                pass
-
-            if len(moves) == 0:
-                self.gameBoard.shuffle()
+        random_move(self.gameBoard)
 
         #print("I moved "+str(movePos)+" in direction "+str(moveDir))
 
-# Each node has an object and its heuristic score
-class Node:
-    def __init__(self, obj, score, level=None):
-        self.obj = obj
-        self.score = score
-        if level == None:
-            self.level = 0
-        else:
-            self.level = level
-        self.children = []
-        self.parent = None
+# RandomPlayer's policy: a uniformly random valid move, shuffling until there is one
+def random_move(board):
+    while True:
+        moves = board.legal_moves()
+        if len(moves) > 0:
+            move = moves[random.randrange(len(moves))]
+            board.move(move[0],move[1], move[2])
+            return move
+
+        board.shuffle()
+
+# Monte Carlo tree search (UCT) player
+# Refills are random, so the tree is open loop: a node stands for the moves
+# that lead to it, and each rollout replays them on a fresh copy of the board
+# Only children whose move is valid on the replayed board can be selected
+# A rollout plays RandomPlayer's policy to the end of the game (or for
+# rollout_depth moves) and scores the points gained since the root
+# After a move, that move's subtree becomes the root for the next one
+class MCTSPlayer(Player):
+    ROLLOUT_DEPTH = 20  # Random moves per rollout when none is given
+
+    # rollout_depth 0 plays every rollout to the end of the game
+    def __init__(self, rollouts=None, time_limit=None, exploration=None, rollout_depth=None):
+        super().__init__()
+        self.rollouts = rollouts    # Rollouts per move
+        self.time_limit = time_limit    # Seconds of search per move
+        if rollouts == None and time_limit == None:
+            self.rollouts = 100
+        self.exploration = exploration if exploration != None else math.sqrt(2)
+        self.rollout_depth = rollout_depth if rollout_depth != None else MCTSPlayer.ROLLOUT_DEPTH
+        self.root = None
+        self.max_reward = 1 # Largest rollout reward seen, scales the rewards for UCT
+        self.num_children = 0
+        self.total_rollouts = 0
+        self.search_time = 0
 
-    def add_child(self, obj, score):
-        self.children.append(Node(obj,score))
-        self.children[-1].parent = self
+    def next_move(self):
+        while len(self.gameBoard.legal_moves()) == 0:
+            self.gameBoard.shuffle()
+            self.root = None
+        if self.root == None:
+            self.root = MCTSNode(None)
+
+        start = time.time()
+        deadline = None
+        if self.time_limit != None:
+            deadline = start+self.time_limit
+        count = 0
+        while (self.rollouts == None or count < self.rollouts) and \
+                (deadline == None or time.time() < deadline):
+            self.rollout(self.total_rollouts+count, deadline)
+            count = count + 1
+        self.search_time = self.search_time + (time.time()-start)
+        self.total_rollouts = self.total_rollouts + count
+        self.num_children = self.num_children + len(self.root.children)
+
+        # Most visited valid move, then the best average
+        best = None
+        for move in self.gameBoard.legal_moves():
+            child = self.root.children.get(move)
+            if child != None and (best == None or (child.visits, child.total/child.visits) > (best.visits, best.total/best.visits)):
+                best = child
+        if best == None:
+            random_move(self.gameBoard)
+            self.root = None
+            return
+        self.gameBoard.move(best.move[0],best.move[1],best.move[2])
+        # Keep the subtree below the move just played
+        best.parent = None
+        self.root = best
+
+    # One selection, expansion, random playout and backup from the root
+    # A board with its own stream refills from a fork salted with the rollout's
+    # number, so rollouts see different refills
+    # The random playout stops at the deadline (a time.time() value), if any
+    def rollout(self, index=0, deadline=None):
+        board = self.gameBoard.copyme()
+        if board.refills == None:
+            board.rng = fork_rng(self.gameBoard.rng, index)
+        base = board.score
+        node = self.root
+        path = [node]
+        while board.finish == False:
+            moves = board.legal_moves()
+            if len(moves) == 0:
+                board.shuffle()
+                continue
+            untried = [move for move in moves if move not in node.children]
+            if len(untried) > 0:
+                move = untried[random.randrange(len(untried))]
+                board.move(move[0],move[1],move[2])
+                child = MCTSNode(move)
+                child.parent = node
+                node.children[move] = child
+                path.append(child)
+                self.nodes_expanded = self.nodes_expanded + 1
+                break
+            node = self.select(node, moves)
+            board.move(node.move[0],node.move[1],node.move[2])
+            path.append(node)
 
-    def add_children(self, children):
-        for child in children:
-            child.parent = self
-        self.children.extend(children)
+        depth = 0
+        while board.finish == False and (self.rollout_depth == 0 or depth < self.rollout_depth):
+            if deadline != None and time.time() >= deadline:
+                break
+            random_move(board)
+            depth = depth + 1
+
+        reward = board.score - base
+        if reward > self.max_reward:
+            self.max_reward = reward
+        for node in path:
+            node.visits = node.visits + 1
+            node.total = node.total + reward
+
+    # UCT pick among the children valid on this board
+    def select(self, node, moves):
+        best = None
+        best_value = None
+        log_visits = math.log(node.visits)
+        for move in moves:
+            child = node.children[move]
+            value = child.total/(child.visits*self.max_reward) \
+                    + self.exploration*math.sqrt(log_visits/child.visits)
+            if best == None or value > best_value:
+                best = child
+                best_value = value
+        return best
+
+    # Rollouts per second of search over the game
+    def rollout_rate(self):
+        if self.search_time == 0:
+            return 0
+        return self.total_rollouts/self.search_time
+
+# RandomPlayer games for many seeds played side by side on array boards
+# Each step finds the valid moves of every unfinished board in one
+# batch_legal_moves pass, then each board picks and plays one (or shuffles).
+# Every game picks its moves from its own random.Random(seed), which is also
+# the board's stream with rng "shared", so each game is exactly the one
+# Driver(seed) with a RandomPlayer would play and the random module is left alone
+class RandomBatch:
+    def __init__(self, rows, cols, mode, seeds, goal_value, cascade=None, rng=None):
+        self.rows = rows
+        self.cols = cols
+        self.seeds = list(seeds)
+        self.boards = []
+        self.rngs = []  # Stream each game picks its moves from
+        self.move_logs = None   # A list of move records per board, if logging
+        for seed in self.seeds:
+            board = ArrayGameBoard(rows, cols, mode, cascade)
+            init_rng(board, rng, seed)
+            if board.rng == random:
+                board.rng = random.Random(seed)
+                self.rngs.append(board.rng)
+            else:
+                self.rngs.append(random.Random(seed))
+            board.start(goal_value)
+            self.boards.append(board)
+
+    def log_moves(self):
+        self.move_logs = [[] for board in self.boards]
+
+    # One move (or shuffle) on every unfinished board
+    # Returns the number of boards still playing
+    def step(self):
+        active = [k for k in range(len(self.boards)) if self.boards[k].finish == False]
+        if len(active) == 0:
+            return 0
+        all_moves = batch_legal_moves([self.boards[k] for k in active], self.rows, self.cols)
+        for n in range(len(active)):
+            k = active[n]
+            board = self.boards[k]
+            moves = all_moves[n]
+            if len(moves) > 0:
+                move = moves[self.rngs[k].randrange(len(moves))]
+                score = board.score
+                start = time.time()
+                board.move(move[0], move[1], move[2])
+                if self.move_logs != None:
+                    self.move_logs[k].append({"move":board.move_counter,
+                                              "score_delta":board.score-score,
+                                              "cascade_depth":board.cascade_depth,
+                                              "cells_cleared":board.cells_cleared,
+                                              "specials":board.specials_triggered,
+                                              "nodes":0,
+                                              "depth":0,
+                                              "time":time.time()-start})
+            else:
+                board.shuffle()
+        return len(active)
+
+    # Play every game to the end
+    def play(self):
+        while self.step() > 0:
+            pass
+        for board in self.boards:
+            board.time_elapsed = time.time()-board.start_time
+        return self.boards
+
+# Bounded store of expanded states for AIPlayer: sorted (child board, score)
+# pairs per state, least recently used state evicted first
+# A state is keyed by its board, score, move count and the board's random
+# stream, so a hit gives exactly the children that generating them again would
+# give; boards on the shared random module never see a state twice (its state
+# moves on with every draw), so AIPlayer keeps no table for them
+class TranspositionTable:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, board):
+        if board.refills != None:
+            return (board.hash_key(), board.score, board.move_counter, board.rng.getstate(),
+                    board.refill_pos.tobytes())
+        return (board.hash_key(), board.score, board.move_counter, board.rng.getstate())
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry == None:
+            self.misses = self.misses + 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits = self.hits + 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions = self.evictions + 1
+
+    def __len__(self):
+        return len(self.entries)
+
+# MCTSPlayer's tree: the move from the parent, visit count, total reward
+# and children by move
+class MCTSNode:
+    __slots__ = ("move", "visits", "total", "children", "parent")
+
+    def __init__(self, move):
+        self.move = move
+        self.visits = 0
+        self.total = 0
+        self.children = {}
+        self.parent = None
 
-    def find_avg_score(self):
-        if len(self.children) > 0:
+# AIPlayer's search tree, kept in flat columns instead of one object per node
+# A node is an index (the root is 0); each column holds one value per node
+# Children of a node are added together, so they sit side by side:
+# first[node] is the index of the first one and count[node] how many there are
+class SearchTree:
+    def __init__(self, obj, score):
+        self.obj = []   # Board of each node, None for undo search children
+        self.move = []  # Move from the parent, for nodes that keep no board
+        self.score = array.array('d')
+        self.h_score = array.array('d')    # Score before find_avg_score
+        self.parent = array.array('l')  # -1 for the root
+        self.first = array.array('l')
+        self.count = array.array('l')
+        self.width = array.array('l')   # Beam the children were cut to, 0 until expanded
+        self.add_node(obj, score, -1)
+
+    def __len__(self):
+        return len(self.obj)
+
+    def add_node(self, obj, score, parent):
+        self.obj.append(obj)
+        self.move.append(None)
+        self.score.append(score)
+        self.h_score.append(score)
+        self.parent.append(parent)
+        self.first.append(0)
+        self.count.append(0)
+        self.width.append(0)
+
+    # children is a list of (obj, score) pairs; a node gets its children once
+    def add_children(self, node, children):
+        self.first[node] = len(self.obj)
+        self.count[node] = len(children)
+        for obj, score in children:
+            self.add_node(obj, score, node)
+
+    def children(self, node):
+        return range(self.first[node], self.first[node]+self.count[node])
+
+    def find_avg_score(self, node):
+        count = self.count[node]
+        if count > 0:
+            first = self.first[node]
             children_score = 0
-            for i in self.children:
-                children_score = children_score + i.score
-            avg_children = children_score/len(self.children)
-            self.score = (self.score+avg_children)/2.0
-
-    def delete(self):
-        self.obj = None
-        self.score = None
-        for i in self.children:
-            i.delete()
+            for i in range(first, first+count):
+                children_score = children_score + self.score[i]
+            avg_children = children_score/count
+            self.score[node] = (self.score[node]+avg_children)/2.0
+
+    # Drop every node from index size on, e.g. a level left unfinished
+    def truncate(self, size):
+        del self.obj[size:]
+        del self.move[size:]
+        del self.score[size:]
+        del self.h_score[size:]
+        del self.parent[size:]
+        del self.first[size:]
+        del self.count[size:]
+        del self.width[size:]
+
+# Did board come out of a move the way predicted (a search node) said it would?
+def same_outcome(predicted, board):
+    return predicted.hash_key() == board.hash_key() and predicted.score == board.score \
+            and predicted.move_counter == board.move_counter
+
+# Board random stream (SplitMix64): a 64 bit state, a counter stepped by a
+# fixed odd constant and mixed into each output, so copying it is copying an int
+# Same randrange/getstate/setstate calls as the random module, which boards
+# share by default (Driver.RNG)
+MASK64 = (1 << 64) - 1
+
+def mix64(z):
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+class SplitMix64:
+    __slots__ = ("state",)
+    GAMMA = 0x9E3779B97F4A7C15
+    FORK = 0xD1B54A32D192ED03
+
+    def __init__(self, seed=0):
+        self.state = seed & MASK64
+
+    def next(self):
+        self.state = (self.state + SplitMix64.GAMMA) & MASK64
+        return mix64(self.state)
+
+    def randrange(self, n):
+        return (self.next() * n) >> 64
+
+    def getstate(self):
+        return self.state
+
+    def setstate(self, state):
+        self.state = state
+
+    # Stream for a copy of the board, made from this one's state without
+    # stepping it, so a copy never draws the numbers the board itself will
+    # Copies of the same board (same salt) get the same stream
+    def fork(self, salt=0):
+        return SplitMix64(mix64(self.state ^ SplitMix64.FORK ^ mix64(salt)))
+
+# Stream of the index-th board of a Driver(seed), the same for an int or a str seed
+def board_rng(seed, index=0):
+    return SplitMix64(random.Random(str(seed)+":"+str(index)).getrandbits(64))
+
+# Stream for a copy of a board that draws from rng; the shared random
+# module stays shared
+def fork_rng(rng, salt=0):
+    if rng == random:
+        return rng
+    return rng.fork(salt)
+
+# Known refills: the candies that will fall into each column, fixed in advance
+# Column col's colors come from its own SplitMix64 and are generated a block
+# at a time as far as any board has read; a board only keeps how far it has
+# read each column (GameBoard.refill_pos), so copies share the streams and
+# refill exactly as the board they were copied from will
+class RefillStreams:
+    BLOCK = 64
+
+    def __init__(self, seed, index, cols):
+        self.rngs = [board_rng(seed, str(index)+":refill:"+str(col)) for col in range(cols)]
+        self.colors = [array.array('B') for col in range(cols)]
+
+    # Color index of the pos-th candy to fall into col
+    def color(self, col, pos):
+        stream = self.colors[col]
+        while pos >= len(stream):
+            rng = self.rngs[col]
+            for i in range(RefillStreams.BLOCK):
+                stream.append(rng.randrange(len(Candy.COLORS)))
+        return stream[pos]
+
+# Give a board its stream for a Driver.RNG mode
+def init_rng(board, rng, seed, index=0):
+    if rng == Driver.RNG[1] or rng == Driver.RNG[2]:
+        board.rng = board_rng(seed, index)
+    if rng == Driver.RNG[2]:
+        board.refills = RefillStreams(seed, index, board.cols)
+        board.refill_pos = array.array('l', [0]*board.cols)
 
 class GameBoard:
     MOVES = ["u", "d", "l", "r"]    # Up,down,left,right
     MODE = ["main", "time", "jelly", "main+jelly"]
+    SHUFFLE_TRIES = 20  # Placements shuffle_candies gets before shuffle falls back to redraw
+    SHUFFLE_REDRAWS = 100   # Then redraws before shuffle gives up on the board
 
     def __init__(self, rows, cols, mode):
         self.last_move = None   # ex. (row,col,"down")
+        self.cascade_depth = 0  # Board updates that crushed something on the last move
+        self.cells_cleared = 0  # Squares crushed on the last move, see crush_ranges
+        self.specials_triggered = 0 # Striped candies and chocolates set off on the last move
         self.rows = rows
         self.cols = cols
         self.score = 0  # 1 point for each crush
@@ -491,13 +1227,81 @@ class GameBoard:
         self.start_time = None
         self.finish = False
         self.goal_value = None
-        self.squares = [[0 for j in range(self.cols)] for i in range(self.rows)]
+        self.legal_cache = None   # (board key, move codes, moves) from last legal_moves()
+        self.journal = []   # States to go back to, see push_journal
+        self.rng = random   # Stream for new candies, shuffles and jelly, see SplitMix64
+        self.refills = None # Known refills, see RefillStreams
+        self.refill_pos = None  # Candies read from each column's refill stream
+        self.jelly_mask = 0 # Bit row*cols+col set for each jelly square, see jelly_terms
+        self.init_squares()
         if mode in GameBoard.MODE:
             self.mode = mode
         else:
             print("ERROR: Invalid Mode of Play")
             raise Exception("Invalid Mode of Play")
 
+    def init_squares(self):
+        self.squares = [[0 for j in range(self.cols)] for i in range(self.rows)]
+        self.init_cells()
+
+    # Both engines keep every square's cell code (see encode_candy), written
+    # only through set_cell, which keeps the Zobrist hashes current and, while
+    # journaling, records each square's old code
+    def init_cells(self):
+        self.cells = bytearray([EMPTY]) * (self.rows*self.cols)
+        self.changes = None   # (square, old code) pairs written while journaling
+        self.zobrist = zobrist_keys(len(self.cells))
+        # Zobrist hash of the whole board and of each row
+        self.row_hash = zobrist_rows(self.cells, self.rows, self.cols)
+        self.zhash = 0
+        for h in self.row_hash:
+            self.zhash = self.zhash ^ h
+
+    # The random module itself cannot be pickled (e.g. for a process pool),
+    # so a board on the shared stream goes without it and gets it back
+    # The zobrist keys are the module's table, which every process builds the
+    # same, so a pickled board goes without them too
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if state["rng"] == random:
+            state["rng"] = None
+        del state["zobrist"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.rng == None:
+            self.rng = random
+        self.zobrist = zobrist_keys(len(self.cells))
+
+    # Draws from the board's stream, in the order Candy and StripedCandy make them
+    def random_color(self):
+        return Candy.COLORS[self.rng.randrange(len(Candy.COLORS))]
+
+    def random_direction(self):
+        return StripedCandy.DIR[self.rng.randrange(len(StripedCandy.DIR))]
+
+    # Color index of a new candy falling into col
+    def refill_color(self, col):
+        if self.refills == None:
+            return self.rng.randrange(len(Candy.COLORS))
+        pos = self.refill_pos[col]
+        self.refill_pos[col] = pos + 1
+        return self.refills.color(col, pos)
+
+    # Stream for a copy of this board, or a search on it: the shared module,
+    # a fork of the board's own stream, or with known refills an exact copy
+    def search_rng(self):
+        if self.refills != None:
+            return SplitMix64(self.rng.getstate())
+        return fork_rng(self.rng)
+
+    # Known refills go with the copies, see RefillStreams
+    def copy_refills(self, copyTo):
+        if self.refills != None:
+            copyTo.refills = self.refills
+            copyTo.refill_pos = self.refill_pos[:]
+
     def copyme(self):
         copyTo = GameBoard(self.rows,self.cols,self.mode)
         #copyTo.last_move = self.last_move
@@ -506,6 +1310,13 @@ class GameBoard:
         copyTo.start_time = self.start_time
         copyTo.finish = self.finish
         copyTo.goal_value = self.goal_value
+        copyTo.legal_cache = self.legal_cache
+        copyTo.rng = self.search_rng()
+        self.copy_refills(copyTo)
+        copyTo.jelly_mask = self.jelly_mask
+        copyTo.cells[:] = self.cells
+        copyTo.row_hash = self.row_hash[:]
+        copyTo.zhash = self.zhash
 
         for row in range(len(self.squares)):
             for col in range(len(self.squares[row])):
@@ -516,21 +1327,157 @@ class GameBoard:
 
         return copyTo
 
+    # Candy at a square, IndexError when off the board
+    def candy_at(self, row, col):
+        return self.squares[row][col].candy
+
+    # Board as cell codes: the cells themselves, not a copy
+    def encode(self):
+        return self.cells
+
+    # Every write to a square goes through here to keep the hashes current
+    def set_cell(self, i, code):
+        old = self.cells[i]
+        if old != code:
+            if self.changes != None:
+                self.changes.append(i)
+                self.changes.append(old)
+            key = self.zobrist[i << 8 | old] ^ self.zobrist[i << 8 | code]
+            self.zhash = self.zhash ^ key
+            self.row_hash[i // self.cols] = self.row_hash[i // self.cols] ^ key
+            self.cells[i] = code
+
+    # Put a candy (None for none) on a square; jelly None leaves the jelly as is
+    def set_square(self, row, col, candy, jelly=None):
+        square = self.squares[row][col]
+        square.candy = candy
+        if jelly != None:
+            square.jelly = jelly
+        code = encode_candy(candy)
+        if square.jelly == True:
+            code = code | JELLY
+        self.set_cell(row*self.cols+col, code)
+
+    # Set square i to a cell code, as set_square would
+    def put_cell(self, i, code):
+        row, col = divmod(i, self.cols)
+        self.squares[row][col].candy = decode_candy(code)
+        self.squares[row][col].jelly = (code & JELLY) != 0
+        self.set_cell(i, code)
+
+    # Make/unmake: play a move that unmake_move can take back again
+    def make_move(self, moveRow, moveCol, moveDir):
+        self.push_journal()
+        try:
+            self.move(moveRow, moveCol, moveDir)
+        except RuntimeError:
+            self.pop_journal()
+            raise
+
+    def unmake_move(self):
+        self.pop_journal()
+
+    # Remember everything a move or shuffle can change: score, move count,
+    # jelly count and squares, finish flag, last move, cached legal moves, the
+    # random stream, the squares (a mark in the journal of changed cells, see
+    # journal_squares) and how far the known refills were read
+    def push_journal(self):
+        refill_pos = None
+        if self.refill_pos != None:
+            refill_pos = self.refill_pos[:]
+        self.journal.append((self.score, self.move_counter, getattr(self, 'active_jelly', None),
+                self.finish, self.last_move, self.legal_cache, self.rng.getstate(),
+                self.journal_squares(), refill_pos, self.jelly_mask))
+
+    # Go back to the state of the matching push_journal
+    def pop_journal(self):
+        entry = self.journal.pop()
+        self.score = entry[0]
+        self.move_counter = entry[1]
+        if entry[2] != None:
+            self.active_jelly = entry[2]
+        self.finish = entry[3]
+        self.last_move = entry[4]
+        self.legal_cache = entry[5]
+        self.rng.setstate(entry[6])
+        self.restore_squares(entry[7])
+        if entry[8] != None:
+            self.refill_pos = entry[8]
+        self.jelly_mask = entry[9]
+
+    # Only the squares set_cell writes are journaled, as a mark in self.changes
+    def journal_squares(self):
+        if self.changes == None:
+            self.changes = []
+        return len(self.changes)
+
+    def restore_squares(self, mark):
+        changes = self.changes
+        self.changes = None
+        while len(changes) > mark:
+            old = changes.pop()
+            self.put_cell(changes.pop(), old)
+        if len(self.journal) > 0:
+            self.changes = changes
+
     def swap_candy(self, moveFromRow, moveFromCol, moveToRow, moveToCol):
         temp_candy = self.squares[moveFromRow][moveFromCol].candy
-        self.squares[moveFromRow][moveFromCol].candy = self.squares[moveToRow][moveToCol].candy
-        self.squares[moveToRow][moveToCol].candy = temp_candy
+        self.set_square(moveFromRow, moveFromCol, self.squares[moveToRow][moveToCol].candy)
+        self.set_square(moveToRow, moveToCol, temp_candy)
 
+    # Rearrange the candies so the board has no match and at least one valid
+    # move; jelly stays where it is. Returns the retries it took
+    # Raises an Exception for a board that gets no valid move even from new
+    # colors (e.g. one too small to line up 3 candies)
     def shuffle(self):
         old_score = self.score
-        for row in range(len(self.squares)):
-            for col in range(len(self.squares[row])):
-                self.swap_candy(row,col,random.randrange(self.rows),random.randrange(self.cols))
+        retries = 0
+        while True:
+            if retries < GameBoard.SHUFFLE_TRIES:
+                cells = shuffle_candies(self.encode(), self.rows, self.cols, self.rng)
+                if cells == None:
+                    retries = retries + 1
+                    continue
+                self.place_cells(cells)
+                # An exploding chocolate still goes off wherever it lands
+                if bytes(cells).translate(EXPLODING_PLANE).find(1) != -1:
+                    self.settle()
+            elif retries < GameBoard.SHUFFLE_TRIES + GameBoard.SHUFFLE_REDRAWS:
+                # These candies cannot be placed with a valid move (e.g. too
+                # few of each color left), so give them new colors
+                self.redraw()
+            else:
+                print("ERROR: No valid move after "+str(retries)+" shuffles")
+                raise Exception("No valid move after "+str(retries)+" shuffles")
+            if len(self.legal_moves()) > 0:
+                break
+            retries = retries + 1
+        # Reset to old score in case a shuffle caused some crushes
+        self.score = old_score
+        if PROFILE != None:
+            PROFILE.add_shuffle(retries)
+        return retries
+
+    # New color from the board's stream for every candy but the chocolates,
+    # striped candies staying striped; the board crushes and refills any match
+    def redraw(self):
+        cells = bytearray(self.encode())
+        for i in range(len(cells)):
+            if cells[i] & COLOR_MASK < CHOCOLATE:
+                cells[i] = (cells[i] & ~COLOR_MASK) | self.rng.randrange(len(Candy.COLORS))
+        self.place_cells(cells)
+        self.settle()
+
+    def settle(self):
         res = True
         while res == True:
             res = self.update_board()
-        # Reset to old score in case a shuffle caused some crushes
-        self.score = old_score
+
+    # Set every square to its cell code (see encode), writing only those that differ
+    def place_cells(self, cells):
+        for i in range(len(cells)):
+            if cells[i] != self.cells[i]:
+                self.put_cell(i, cells[i])
 
     # Create board and init variables
     # Used as a reset as well
@@ -538,7 +1485,9 @@ class GameBoard:
         # Init each square in the game board
         for row in range(len(self.squares)):
             for col in range(len(self.squares[row])):
-                self.squares[row][col] = Square()
+                candy = Candy(self.random_color())
+                self.squares[row][col] = Square(candy)
+                self.set_square(row, col, candy, False)
 
         # Needed so that the initial board has no crushes when Player begins
         res = True
@@ -550,13 +1499,12 @@ class GameBoard:
             self.active_jelly = goal_value["jelly"]
             for i in range(self.active_jelly):
                 while True:
-                    try:
-                        row = random.randrange(self.rows)
-                        col = random.randrange(self.cols)
-                        self.squares[row][col].set_jelly()
+                    row = self.rng.randrange(self.rows)
+                    col = self.rng.randrange(self.cols)
+                    if self.squares[row][col].jelly == False:
+                        self.set_square(row, col, self.squares[row][col].candy, True)
+                        self.jelly_mask = self.jelly_mask | (1 << (row*self.cols+col))
                         break
-                    except RuntimeError as e:
-                        pass
 
         # Set/reset variables
         self.move_counter = 0   # Move counter
@@ -603,9 +1551,16 @@ class GameBoard:
         self.last_move = (moveRow, moveCol, moveDir)
 
         # Update the board
+        self.cascade_depth = 0
+        self.cells_cleared = 0
+        self.specials_triggered = 0
         res = True
         while res == True:
             res = self.update_board()
+            if res == True:
+                self.cascade_depth = self.cascade_depth + 1
+        if PROFILE != None:
+            PROFILE.add_cascade(self.cascade_depth, self.cells_cleared, self.specials_triggered)
 
         # Increment move counter
         self.move_counter = self.move_counter + 1
@@ -636,13 +1591,20 @@ class GameBoard:
                 self.finish = True
             elif self.move_counter == self.goal_value["moves"]:
                 self.finish = True
-            elif self.move_counter > self.goal_vlaue["moves"]:
+            elif self.move_counter > self.goal_value["moves"]:
                 raise Exception("ERROR: Max moves reached, but a move happened")
                 print("ERROR: Max moves reached, but a move happened")
         else:
             print("You shouldn't see this")
             raise Exception("You shouldn't see this")
 
+    # The last move of a game with a move limit has been played; a search
+    # stops there. The jelly mode has no move limit (and time mode's is the clock)
+    def out_of_moves(self):
+        if self.mode == GameBoard.MODE[0] or self.mode == GameBoard.MODE[3]:
+            return self.move_counter >= self.goal_value["moves"]
+        return False
+
     def move_up(self, moveRow, moveCol):
         # Need to check if either is a chocolate
         if isinstance(self.squares[moveRow][moveCol].candy, Chocolate) \
@@ -650,8 +1612,8 @@ class GameBoard:
             # First remove the 2 candies and add 2 points
             candy1 = self.squares[moveRow][moveCol].candy.copyme()
             candy2 = self.squares[moveRow-1][moveCol].candy.copyme()
-            self.squares[moveRow][moveCol].candy = None
-            self.squares[moveRow-1][moveCol].candy = None
+            self.set_square(moveRow, moveCol, None)
+            self.set_square(moveRow-1, moveCol, None)
             self.score = self.score + 2
             # Now check for which combo
             self.chocolate_combo(candy1, candy2)
@@ -659,8 +1621,8 @@ class GameBoard:
         # Need to check if both are striped candies
         elif isinstance(self.squares[moveRow][moveCol].candy, StripedCandy) \
                     and isinstance(self.squares[moveRow-1][moveCol].candy, StripedCandy):
-            self.squares[moveRow][moveCol].candy = None
-            self.squares[moveRow-1][moveCol].candy = None
+            self.set_square(moveRow, moveCol, None)
+            self.set_square(moveRow-1, moveCol, None)
             self.stripe_combo(moveRow-1, moveCol)
 
         # Else, just a normal move
@@ -676,8 +1638,8 @@ class GameBoard:
             # First remove the 2 candies and add 2 points
             candy1 = self.squares[moveRow][moveCol].candy.copyme()
             candy2 = self.squares[moveRow+1][moveCol].candy.copyme()
-            self.squares[moveRow][moveCol].candy = None
-            self.squares[moveRow+1][moveCol].candy = None
+            self.set_square(moveRow, moveCol, None)
+            self.set_square(moveRow+1, moveCol, None)
             self.score = self.score + 2
             # Now check for which combo
             self.chocolate_combo(candy1, candy2)
@@ -685,8 +1647,8 @@ class GameBoard:
         # Need to check if both are striped candies
         elif isinstance(self.squares[moveRow][moveCol].candy, StripedCandy) \
                     and isinstance(self.squares[moveRow+1][moveCol].candy, StripedCandy):
-            self.squares[moveRow][moveCol].candy = None
-            self.squares[moveRow+1][moveCol].candy = None
+            self.set_square(moveRow, moveCol, None)
+            self.set_square(moveRow+1, moveCol, None)
             self.stripe_combo(moveRow+1, moveCol)
 
         # Else, just a normal move
@@ -702,8 +1664,8 @@ class GameBoard:
             # First remove the 2 candies and add 2 points
             candy1 = self.squares[moveRow][moveCol].candy.copyme()
             candy2 = self.squares[moveRow][moveCol-1].candy.copyme()
-            self.squares[moveRow][moveCol].candy = None
-            self.squares[moveRow][moveCol-1].candy = None
+            self.set_square(moveRow, moveCol, None)
+            self.set_square(moveRow, moveCol-1, None)
             self.score = self.score + 2
             # Now check for which combo
             self.chocolate_combo(candy1, candy2)
@@ -711,8 +1673,8 @@ class GameBoard:
         # Need to check if both are striped candies
         elif isinstance(self.squares[moveRow][moveCol].candy, StripedCandy) \
                     and isinstance(self.squares[moveRow][moveCol-1].candy, StripedCandy):
-            self.squares[moveRow][moveCol].candy = None
-            self.squares[moveRow][moveCol-1].candy = None
+            self.set_square(moveRow, moveCol, None)
+            self.set_square(moveRow, moveCol-1, None)
             self.stripe_combo(moveRow, moveCol-1)
 
         # Else, just a normal move
@@ -728,8 +1690,8 @@ class GameBoard:
             # First remove the 2 candies and add 2 points
             candy1 = self.squares[moveRow][moveCol].candy.copyme()
             candy2 = self.squares[moveRow][moveCol+1].candy.copyme()
-            self.squares[moveRow][moveCol].candy = None
-            self.squares[moveRow][moveCol+1].candy = None
+            self.set_square(moveRow, moveCol, None)
+            self.set_square(moveRow, moveCol+1, None)
             self.score = self.score + 2
             # Now check for which combo
             self.chocolate_combo(candy1, candy2)
@@ -737,8 +1699,8 @@ class GameBoard:
         # Need to check if both are striped candies
         elif isinstance(self.squares[moveRow][moveCol].candy, StripedCandy) \
                     and isinstance(self.squares[moveRow][moveCol+1].candy, StripedCandy):
-            self.squares[moveRow][moveCol].candy = None
-            self.squares[moveRow][moveCol+1].candy = None
+            self.set_square(moveRow, moveCol, None)
+            self.set_square(moveRow, moveCol+1, None)
             self.stripe_combo(moveRow, moveCol+1)
 
         # Else, just a normal move
@@ -747,36 +1709,49 @@ class GameBoard:
             self.check_match(moveRow,moveCol,moveRow,moveCol+1)
             self.swap_candy(moveRow,moveCol,moveRow,moveCol+1)
 
-    # Creates a copy of this game and does the move
-    # If nothing is crushed, then the move is invalid
+    # If the swap does not line up 3 candies, then the move is invalid
+    # Only the squares around the swap are looked at; no board copy needed
     def check_match(self, moveFromRow, moveFromCol, moveToRow, moveToCol):
-        temp_board = self.copyme()
-        temp_board.swap_candy(moveFromRow, moveFromCol, moveToRow, moveToCol)
-
-        res = temp_board.check_valid_move()
+        cells = self.encode()
+        colors = bytes(cells).translate(COLOR_PLANE)
+        res = swap_is_legal(cells, colors, self.rows, self.cols,
+                moveFromRow*self.cols+moveFromCol, moveToRow*self.cols+moveToCol)
         if res == False:
             raise RuntimeError("Not a valid 3-match move")
 
-    def check_valid_move(self):
-        for row in range(len(self.squares)):
-            for col in range(len(self.squares[row])):
-                # For each square, see if we have 3/4/5 matching colors
-                # After a crush, we repopulate the empty squares and restart this
-                
-                # Check if we have a match to the right
-                if col < self.cols-2:
-                    res_right = self.check_right(row, col)
-                    if res_right == True:
-                        return True
+    # All valid moves as (row,col,dir) with dir "r" or "d", in scan order
+    # Only swaps near squares changed since the last call are looked at again
+    def legal_moves(self):
+        cells = self.encode()
+        key = bytes(cells).translate(LEGAL_PLANE)
+        if self.legal_cache != None and self.legal_cache[0] == key:
+            return self.legal_cache[2]
+
+        recheck = None
+        if self.legal_cache != None:
+            old_key = self.legal_cache[0]
+            dirty = [i for i in range(len(key)) if old_key[i] != key[i]]
+            # Past a quarter of the board it is cheaper to start over
+            if len(dirty)*4 <= len(key):
+                recheck = legal_neighborhood(dirty, self.rows, self.cols)
+
+        if recheck == None:
+            codes = legal_swaps(cells, self.rows, self.cols, range(len(key)))
+        else:
+            codes = [code for code in self.legal_cache[1] if code//2 not in recheck]
+            codes.extend(legal_swaps(cells, self.rows, self.cols, recheck))
+            codes.sort()
 
-                # Check if we have a match down
-                if row < self.rows-2:
-                    res_down = self.check_down(row, col)
-                    if res_down == True:
-                        return True
+        moves = []
+        for code in codes:
+            row, col = divmod(code//2, self.cols)
+            moves.append((row, col, GameBoard.MOVES[3] if code % 2 == 0 else GameBoard.MOVES[1]))
+        self.legal_cache = (key, codes, moves)
+        return moves
 
-        # Nothing crushed
-        return False
+    # True if update_board would crush something; never changes the board
+    def check_valid_move(self):
+        return len(find_matches(self.encode(), self.rows, self.cols)) > 0
 
     # Chocolate + Candy
     def chocolate_combo(self, candy1, candy2):
@@ -787,11 +1762,12 @@ class GameBoard:
             for row in range(len(self.squares)):
                 for col in range(len(self.squares[row])):
                     if not isinstance(self.squares[row][col].candy, Chocolate):
-                        self.squares[row][col].candy = None
-                        self.squares[row][col].set_candy()
+                        self.set_square(row, col, Candy(self.random_color()))
                         self.score = self.score + 1
                     else:
-                        self.squares[row][col].candy.exploding = True
+                        chocolate = Chocolate()
+                        chocolate.exploding = True
+                        self.set_square(row, col, chocolate)
             return
         
         # Else if candy1 is a candy
@@ -812,74 +1788,119 @@ class GameBoard:
             for row in range(len(self.squares)):
                 for col in range(len(self.squares[row])):
                     if self.squares[row][col].candy != None and self.squares[row][col].candy.color == candy.color:
-                        self.squares[row][col].candy = None
-                        self.squares[row][col].set_striped_candy(candy.color)
+                        self.set_square(row, col, StripedCandy(candy.color,self.random_direction()))
 
-        # Finally, crush all the candies of the same color one-by-one
-        for row in range(len(self.squares)):
-            for col in range(len(self.squares[row])):
-                if self.squares[row][col].candy != None and self.squares[row][col].candy.color == candy.color:
-                    self.crush_candy(row,col,row,col)
+        # Finally, crush all the candies of the same color
+        self.crush_color(Candy.COLORS.index(candy.color))
 
         self.move_and_refill()
 
     # Striped Candy + Striped Candy
     def stripe_combo(self, moveRow, moveCol):
-        # First crush all candies in the same column
-        self.crush_candy(0,moveCol,self.rows-1,moveCol)
-
-        # Then crush all candies in the same row
-        self.crush_candy(moveRow,0,moveRow,self.cols-1)
+        # All candies in the same column, then all candies in the same row
+        self.crush_ranges([(0,moveCol,self.rows-1,moveCol), (moveRow,0,moveRow,self.cols-1)])
 
         self.move_and_refill()
 
     # Crush all candy from one square to another in some direction
     def crush_candy(self, crushFromRow, crushFromCol, crushToRow, crushToCol):
-        #self.print_board()
-        #print("Crush from,to: "+str(crushFromRow)+","+str(crushFromCol)+" "+str(crushToRow)+","+str(crushToCol))
-        for row in range(crushFromRow,crushToRow+1):
-            for col in range(crushFromCol, crushToCol+1):
-                # If no candy here, ignore
-                if self.squares[row][col].candy == None:
-                    continue
-    
-                # If jelly here, eliminate it
-                if self.squares[row][col].jelly == True:
-                    self.squares[row][col].jelly = False
-                    self.active_jelly = self.active_jelly - 1
-
-                # If this is a striped candy, recurse and crush more
-                if isinstance(self.squares[row][col].candy,StripedCandy):
-                    # If vertical striped candy
-                    if self.squares[row][col].candy.direction == StripedCandy.DIR[0]:
-                        self.squares[row][col].candy = None
-                        self.score = self.score + 1
-                        self.crush_candy(0,col,self.rows-1,col)
-                    # Else, horizontal striped candy
-                    else:
-                        self.squares[row][col].candy = None
-                        self.score = self.score + 1
-                        self.crush_candy(row,0,row,self.cols-1)
-                # If this is a chocolate, destroy all same random colored candy
-                elif isinstance(self.squares[row][col].candy,Chocolate):
-                    self.squares[row][col].candy = None
-                    self.score = self.score + 1
-                    acolor = Candy.COLORS[random.randrange(len(Candy.COLORS))]
-                    for row in range(len(self.squares)):
-                        for col in range(len(self.squares[row])):
-                            if self.squares[row][col].candy != None \
-                                        and self.squares[row][col].candy.color == acolor:
-                                self.squares[row][col].candy = None
-                                self.score = self.score + 1
-                # Else, just a normal Candy
+        self.crush_ranges([(crushFromRow, crushFromCol, crushToRow, crushToCol)])
+
+    # Crush every square of ranges, (from row, from col, to row, to col) each,
+    # and everything that sets off, with a work queue instead of recursion
+    # Squares come off a stack in range order, a striped candy's line going on
+    # top so it is crushed before the rest of its range; a chocolate draws its
+    # color when it is reached and takes every candy of that color as it is
+    # (no jelly, no stripes set off). Each square is marked once, then cleared
+    # with the score, jelly and cascade counters added up in one pass
+    def crush_ranges(self, ranges):
+        squares = self.squares
+        cols = self.cols
+        stack = crush_stack(ranges, cols)
+        cleared = {}    # Square -> True if its jelly goes too
+        specials = 0
+        while len(stack) > 0:
+            i = stack.pop()
+            candy = squares[i // cols][i % cols].candy
+            # If no candy here, ignore
+            if candy == None or i in cleared:
+                continue
+            cleared[i] = True
+            # If this is a striped candy, crush its line next
+            if isinstance(candy, StripedCandy):
+                specials = specials + 1
+                # If vertical striped candy
+                if candy.direction == StripedCandy.DIR[0]:
+                    stack.extend(range((self.rows-1)*cols+i % cols, -1, -cols))
+                # Else, horizontal striped candy
                 else:
-                    self.squares[row][col].candy = None
-                    self.score = self.score + 1
+                    stack.extend(range((i // cols+1)*cols-1, (i // cols)*cols-1, -1))
+            # If this is a chocolate, destroy all same random colored candy
+            elif isinstance(candy, Chocolate):
+                specials = specials + 1
+                acolor = self.random_color()
+                for j in range(self.rows*cols):
+                    candy = squares[j // cols][j % cols].candy
+                    if candy != None and candy.color == acolor and j not in cleared:
+                        cleared[j] = False
+
+        for i in cleared:
+            square = squares[i // cols][i % cols]
+            # If jelly here, eliminate it
+            if cleared[i] and square.jelly == True:
+                self.set_square(i // cols, i % cols, None, False)
+                self.active_jelly = self.active_jelly - 1
+                self.jelly_mask = self.jelly_mask & ~(1 << i)
+            else:
+                self.set_square(i // cols, i % cols, None)
+        self.score = self.score + len(cleared)
+        self.cells_cleared = self.cells_cleared + len(cleared)
+        self.specials_triggered = self.specials_triggered + specials
+
+    # Crush every candy of a color (index into Candy.COLORS) and all that sets
+    # off, as crushing them one by one in board order with crush_candy would:
+    # the squares are found as bitmasks (see stripe_closure), then cleared
+    # and scored at once
+    def crush_color(self, color):
+        cells = self.encode()
+        start = cell_mask(cells, COLOR_BITS[color])
+        closure = stripe_closure(start, cell_mask(cells, VERTICAL_BITS), cell_mask(cells, HORIZONTAL_BITS),
+                cell_mask(cells, CHOCOLATE_BITS), self.rows, self.cols)
+        if closure == None:
+            ranges = []
+            while start != 0:
+                i = (start & -start).bit_length()-1
+                ranges.append((i // self.cols, i % self.cols, i // self.cols, i % self.cols))
+                start = start & (start-1)
+            self.crush_ranges(ranges)
+            return
+        crushed, specials = closure
+        # Lines crossing squares with no candy leave them (and their jelly) alone
+        crushed = crushed & cell_mask(cells, CANDY_BITS)
+        jelly = crushed & self.jelly_mask
+        if jelly != 0:
+            self.active_jelly = self.active_jelly - bin(jelly).count("1")
+            self.jelly_mask = self.jelly_mask & ~jelly
+        self.clear_squares(crushed)
+        count = bin(crushed).count("1")
+        self.score = self.score + count
+        self.cells_cleared = self.cells_cleared + count
+        self.specials_triggered = self.specials_triggered + specials
+
+    # Remove the candy and jelly of every square in a bitmask
+    def clear_squares(self, mask):
+        while mask != 0:
+            i = (mask & -mask).bit_length()-1
+            self.set_square(i // self.cols, i % self.cols, None, False)
+            mask = mask & (mask-1)
 
     # Continue crushing until nothing else is crushable on the board
     # Go from top-down, left-right
     # Return True if there was a crush, False otherwise
     def update_board(self):
+        # Boards under 3 rows (or cols) never check one of the directions
+        res_right = False
+        res_down = False
         for row in range(len(self.squares)):
             for col in range(len(self.squares[row])):
                 # For each square, see if we have 3/4/5 matching colors
@@ -932,10 +1953,10 @@ class GameBoard:
                 pass
             # Match 4; striped candy formed after crush
             elif match_counter == 4:
-                self.squares[row][col].set_striped_candy(candy.color,StripedCandy.DIR[0])
+                self.set_square(row, col, StripedCandy(candy.color,StripedCandy.DIR[0]))
             # Match 5; chocolate formed after crush
             else:
-                self.squares[row][col].set_chocolate()
+                self.set_square(row, col, Chocolate())
 
             return True
 
@@ -969,29 +1990,46 @@ class GameBoard:
             # Match 4; striped candy formed after crush
             elif match_counter == 4:
                 match_counter = match_counter - 1
-                self.squares[row+match_counter][col].set_striped_candy(candy.color,StripedCandy.DIR[1])
+                self.set_square(row+match_counter, col, StripedCandy(candy.color,StripedCandy.DIR[1]))
             # Match 5; chocolate formed after crush
             else:
                 match_counter = match_counter - 1
-                self.squares[row+match_counter][col].set_chocolate()
+                self.set_square(row+match_counter, col, Chocolate())
 
             return True
 
     # Fill empty spaces with upper candy
     # Refill top rows with new candy
-    # Start from bottom-right and go left (i.e. opposite)
+    # Each column with an empty square drops its candies in one pass, then the
+    # gaps left at the top are filled bottom row first, right to left, the
+    # order the old square by square scan drew new candies in
     def move_and_refill(self):
-        for row in range(self.rows-1,-1,-1):
+        squares = self.squares
+        rows = self.rows
+        gaps = []   # Empty squares at the top of each column
+        for col, column in enumerate(zip(*squares)):
+            # Candies are always true, so this looks for a None
+            if all(map(SQUARE_CANDY, column)):
+                gaps.append(0)
+                continue
+            candies = list(map(SQUARE_CANDY, column))
+            # Rows below the lowest empty square keep their candies
+            bottom = rows-1-candies[::-1].index(None)
+            dropped = [candy for candy in candies[:bottom+1] if candy != None]
+            gap = bottom+1-len(dropped)
+            gaps.append(gap)
+            for row in range(bottom+1):
+                if row < gap:
+                    candy = None
+                else:
+                    candy = dropped[row-gap]
+                if candies[row] != candy:
+                    self.set_square(row, col, candy)
+        # Create new random candies
+        for row in range(max(gaps)-1,-1,-1):
             for col in range(self.cols-1,-1,-1):
-                if self.squares[row][col].candy == None:
-                    for new_row in range(row-1,-1,-1):
-                        if self.squares[new_row][col].candy != None:
-                            self.squares[row][col].candy = self.squares[new_row][col].candy
-                            self.squares[new_row][col].candy = None
-                            break
-                    # If we found no upper candy, create a new random one
-                    if self.squares[row][col].candy == None:
-                        self.squares[row][col].set_candy()
+                if row < gaps[col]:
+                    self.set_square(row, col, Candy(Candy.COLORS[self.refill_color(col)]))
 
     def print_info(self):
         self.time_elapsed = time.time()-self.start_time
@@ -1008,38 +2046,829 @@ class GameBoard:
                 print(self.squares[row][col].print_square().rjust(3), end=" ")
             print()
 
+    # Zobrist hash of the board, see zobrist_keys
     def hash_key(self):
-        key = ''
-        for row in range(len(self.squares)):
-            for col in range(len(self.squares[row])):
-                key = key + self.squares[row][col].print_square()
-        return key
+        return self.zhash
+
+    # Squares that differ from another board of the same size
+    # Rows whose Zobrist hashes agree are skipped without looking at them
+    def changed_squares(self, agameboard):
+        changed = []
+        if self.zhash == agameboard.zhash:
+            return changed
+        for row in range(self.rows):
+            if self.row_hash[row] != agameboard.row_hash[row]:
+                for i in range(row*self.cols, (row+1)*self.cols):
+                    if self.cells[i] != agameboard.cells[i]:
+                        changed.append(i)
+        return changed
 
     def state_compare_diff(self, agameboard):
-        diff = 0
-        for row in range(len(self.squares)):
-            for col in range(len(self.squares[row])):
-                if self.squares[row][col].print_square() != agameboard.squares[row][col].print_square():
-                    diff = diff + 1
-        return diff
+        return len(self.changed_squares(agameboard))
+
+# Zobrist keys, one random 64-bit number per (square, cell code); a cell code
+# covers candy kind, color, stripe direction and jelly. Each square's keys come
+# from their own fixed seed, never from the game's random stream, so every
+# process and board size agrees on them
+ZOBRIST = []
+
+def zobrist_keys(squares):
+    while len(ZOBRIST) < squares*256:
+        rng = random.Random(len(ZOBRIST) >> 8)
+        ZOBRIST.extend([rng.getrandbits(64) for code in range(256)])
+    return ZOBRIST
+
+def zobrist_rows(cells, rows, cols):
+    keys = zobrist_keys(len(cells))
+    row_hash = []
+    for row in range(rows):
+        h = 0
+        for i in range(row*cols, (row+1)*cols):
+            h = h ^ keys[i << 8 | cells[i]]
+        row_hash.append(h)
+    return row_hash
+
+def zobrist_hash(cells):
+    keys = zobrist_keys(len(cells))
+    h = 0
+    for i in range(len(cells)):
+        h = h ^ keys[i << 8 | cells[i]]
+    return h
+
+# Candy of a Square, for mapping over a column of squares
+SQUARE_CANDY = operator.attrgetter("candy")
+
+# Encode a Candy/StripedCandy/Chocolate (or None) as an ArrayGameBoard cell byte
+def encode_candy(candy):
+    if candy == None:
+        return EMPTY
+    if isinstance(candy, Chocolate):
+        if candy.exploding == True:
+            return CHOCOLATE | EXPLODING
+        return CHOCOLATE
+    code = Candy.COLORS.index(candy.color)
+    if isinstance(candy, StripedCandy):
+        code = code | STRIPED
+        if candy.direction == StripedCandy.DIR[1]:
+            code = code | HORIZONTAL
+    return code
+
+# Shared Candy and StripedCandy for each cell code, filled in by decode_candy
+SHARED_CANDIES = {}
+
+# Inverse of encode_candy: a new Chocolate, or the shared candy for the code
+def decode_candy(code):
+    color = code & COLOR_MASK
+    if color == EMPTY:
+        return None
+    if color == CHOCOLATE:
+        candy = Chocolate()
+        candy.exploding = (code & EXPLODING) != 0
+        return candy
+    code = code & (COLOR_MASK | STRIPED | HORIZONTAL)
+    candy = SHARED_CANDIES.get(code)
+    if candy == None:
+        if code & STRIPED:
+            if code & HORIZONTAL:
+                candy = StripedCandy(Candy.COLORS[color], StripedCandy.DIR[1])
+            else:
+                candy = StripedCandy(Candy.COLORS[color], StripedCandy.DIR[0])
+        else:
+            candy = Candy(Candy.COLORS[color])
+        SHARED_CANDIES[code] = candy
+    return candy
+
+# Find everything update_board would crush, in the order its scan reaches them
+# Returns (row, col, direction, length, color) tuples: direction is "r" for a
+# horizontal run, "d" for a vertical run and None for an exploding chocolate
+# Runs are found for all rows (and all columns) in one regex pass over color planes
+def find_matches(cells, rows, cols):
+    plane = bytes(cells).translate(COLOR_PLANE)
+    found = []
+
+    # Rows joined by a separator so no run crosses from one row into the next
+    horizontal = b'\xff'.join([plane[i:i+cols] for i in range(0, rows*cols, cols)])
+    for match in RUN_RE.finditer(horizontal):
+        row, col = divmod(match.start(), cols+1)
+        found.append((row*cols+col, 0, row, col, GameBoard.MOVES[3], match.end()-match.start(), horizontal[match.start()]))
+
+    # Same again for columns
+    vertical = b'\xff'.join([plane[col::cols] for col in range(cols)])
+    for match in RUN_RE.finditer(vertical):
+        col, row = divmod(match.start(), rows+1)
+        found.append((row*cols+col, 1, row, col, GameBoard.MOVES[1], match.end()-match.start(), vertical[match.start()]))
+
+    # Exploding chocolates, except where the scan never checks (bottom-right corner)
+    exploding = bytes(cells).translate(EXPLODING_PLANE)
+    i = exploding.find(1)
+    while i != -1:
+        row, col = divmod(i, cols)
+        if col < cols-2 or row < rows-2:
+            found.append((i, 0, row, col, None, 1, CHOCOLATE))
+        i = exploding.find(1, i+1)
+
+    found.sort()
+    return [match[2:] for match in found]
+
+# Board terms of AIPlayer.h_func for a batch of settled boards of one size
+# Every board is laid out with a separator row above it and a separator after
+# each row, then each 0/1 plane of the whole batch is packed into one integer
+# (a byte per square). Shifting a plane right by one byte lines every square up
+# with its right neighbor, by one padded row with the neighbor below, so each
+# pairwise term is a few ANDs over all the boards at once
+# Returns (pair_striped, pair_choco, candy_nearby, choco_val) per board
+def heuristic_terms(boards, rows, cols):
+    width = cols+1
+    size = (rows+1)*width
+    separator = b'\xff'*width
+    padded = []
+    for board in boards:
+        cells = bytes(board.encode())
+        padded.append(separator)
+        for i in range(0, rows*cols, cols):
+            padded.append(cells[i:i+cols]+b'\xff')
+    padded.append(separator)
+    padded = b''.join(padded)
+
+    def plane(table):
+        return int.from_bytes(padded.translate(table), 'little')
+    choco = plane(CHOCOLATE_PLANE)
+    plain = plane(PLAIN_PLANE)
+    vertical = plane(VERTICAL_PLANE)
+    horizontal = plane(HORIZONTAL_PLANE)
+    striped = vertical | horizontal
+    colors = [plane(table) for table in COLOR_PLANES]
+
+    # Pairs to the right plus pairs below; bytes stay 0, 1 or 2 so nothing carries
+    pair_striped = 0
+    pair_choco = 0
+    plain_pairs = 0
+    vertical_pairs = 0
+    horizontal_pairs = 0
+    for shift in (8, 8*width):
+        same = 0
+        for color in colors:
+            same = same | (color & (color >> shift))
+        plain_next = plain >> shift
+        pair_striped = pair_striped + (striped & (striped >> shift))
+        pair_choco = pair_choco + (choco & (choco >> shift))
+        plain_pairs = plain_pairs + (same & plain & plain_next)
+        # A striped candy next to a plain one of its color, weighted by its stripe
+        vertical_pairs = vertical_pairs + (same & ((vertical & plain_next) | (plain & (vertical >> shift))))
+        horizontal_pairs = horizontal_pairs + (same & ((horizontal & plain_next) | (plain & (horizontal >> shift))))
+    # Chocolates with no chocolate next to them
+    alone = choco & ~((choco >> 8) | (choco << 8) | (choco >> 8*width) | (choco << 8*width))
+
+    length = len(padded)
+    def per_board(value):
+        return value.to_bytes(length, 'little')
+    pair_striped = per_board(pair_striped)
+    pair_choco = per_board(pair_choco)
+    plain_pairs = per_board(plain_pairs)
+    vertical_pairs = per_board(vertical_pairs)
+    horizontal_pairs = per_board(horizontal_pairs)
+    alone = per_board(alone)
+    color_plane = padded.translate(COLOR_PLANE)
+
+    terms = []
+    for k in range(len(boards)):
+        start = k*size
+        end = start+size
+        def count(plane):
+            return plane.count(1, start, end) + 2*plane.count(2, start, end)
+        color_count = [color_plane.count(color, start, end) for color in range(CHOCOLATE)]
+
+        # Each lone chocolate is worth its best neighbor: the number of candies
+        # of that color, or for a striped neighbor that many new striped candies
+        # of either direction on average
+        choco_val = 0
+        i = alone.find(1, start, end)
+        while i != -1:
+            max_val = 0
+            for j in (i+1, i+width, i-1, i-width):
+                color = padded[j] & COLOR_MASK
+                if color < CHOCOLATE:
+                    if padded[j] & STRIPED:
+                        val = color_count[color]*(rows+cols)/2
+                    else:
+                        val = color_count[color]
+                    if val > max_val:
+                        max_val = val
+            # Add one for chocolate
+            choco_val = choco_val + max_val + 1
+            i = alone.find(1, i+1, end)
+
+        candy_nearby = count(plain_pairs) + count(vertical_pairs)*(rows/3.0) + count(horizontal_pairs)*(cols/3.0)
+        terms.append((count(pair_striped), count(pair_choco), candy_nearby, choco_val))
+    return terms
+
+# Bits of every row and every column of a rows x cols board, as jelly_mask bits
+LINE_MASKS = {}
+
+def line_masks(rows, cols):
+    if (rows, cols) not in LINE_MASKS:
+        row_masks = [((1 << cols)-1) << (row*cols) for row in range(rows)]
+        col_masks = [sum(1 << (row*cols+col) for row in range(rows)) for col in range(cols)]
+        LINE_MASKS[(rows, cols)] = (row_masks, col_masks)
+    return LINE_MASKS[(rows, cols)]
+
+# Jelly terms of AIPlayer.h_func for a settled child board: the jelly squares
+# its move and cascades cleared (set in parent_jelly, the parent's jelly_mask,
+# and gone from the child's), and the jelly lying in the line of each of its
+# striped candies, which crushing that candy would clear
+# Returns (cleared, reach)
+def jelly_terms(board, parent_jelly):
+    cleared = bin(parent_jelly & ~board.jelly_mask).count("1")
+    reach = 0
+    if board.jelly_mask != 0:
+        row_masks, col_masks = line_masks(board.rows, board.cols)
+        cells = board.encode()
+        for table, horizontal in ((VERTICAL_PLANE, False), (HORIZONTAL_PLANE, True)):
+            plane = cells.translate(table)
+            i = plane.find(1)
+            while i != -1:
+                row, col = divmod(i, board.cols)
+                if horizontal:
+                    reach = reach + bin(board.jelly_mask & row_masks[row]).count("1")
+                else:
+                    reach = reach + bin(board.jelly_mask & col_masks[col]).count("1")
+                i = plane.find(1, i+1)
+    return cleared, reach
+
+# Squares of a board as a bitmask (bit row*cols+col), for a table that maps
+# each cell code to the digit 0 or 1
+def cell_mask(cells, table):
+    digits = cells.translate(table)
+    digits.reverse()
+    return int(digits, 2)
+
+def bits_table(plane):
+    return bytes([ord("1") if value else ord("0") for value in plane])
+
+CANDY_BITS = bits_table([code & COLOR_MASK != EMPTY for code in range(256)])
+CHOCOLATE_BITS = bits_table(CHOCOLATE_PLANE)
+VERTICAL_BITS = bits_table(VERTICAL_PLANE)
+HORIZONTAL_BITS = bits_table(HORIZONTAL_PLANE)
+COLOR_BITS = [bits_table(plane) for plane in COLOR_PLANES]
+
+# Squares crushed when the squares in start are crushed, as bitmasks: each
+# striped candy reached adds its whole row or column, until no new striped
+# candy is reached; the order does not matter, since a line crushes the same
+# squares whenever it goes off
+# A chocolate reached draws its color when it is crushed, which depends on
+# the order, so then None is returned and the caller crushes square by square
+# Returns (crushed, striped candies set off)
+def stripe_closure(start, vertical, horizontal, chocolate, rows, cols):
+    row_masks, col_masks = line_masks(rows, cols)
+    striped = vertical | horizontal
+    crushed = start
+    done = 0
+    todo = crushed & striped
+    while todo != 0:
+        low = todo & -todo
+        i = low.bit_length()-1
+        if vertical & low:
+            crushed = crushed | col_masks[i % cols]
+        else:
+            crushed = crushed | row_masks[i // cols]
+        done = done | low
+        todo = crushed & striped & ~done
+    if crushed & chocolate != 0:
+        return None
+    return crushed, bin(done).count("1")
+
+# Work stack for crush_ranges: the squares of every range, each range in
+# row-major order, ready to pop from the end
+def crush_stack(ranges, cols):
+    stack = []
+    for crushFromRow, crushFromCol, crushToRow, crushToCol in reversed(ranges):
+        for row in range(crushToRow, crushFromRow-1, -1):
+            stack.extend(range(row*cols+crushToCol, row*cols+crushFromCol-1, -1))
+    return stack
+
+# Would color at (row,col) line up 3 in a row or column?
+# Squares in direction skip ("u","d","l","r") are ignored; that is the swap partner
+def forms_run(colors, rows, cols, row, col, color, skip):
+    i = row*cols+col
+    count = 0
+    if skip != GameBoard.MOVES[2] and col >= 1 and colors[i-1] == color:
+        count = 1
+        if col >= 2 and colors[i-2] == color:
+            return True
+    if skip != GameBoard.MOVES[3] and col+1 < cols and colors[i+1] == color:
+        if count == 1 or (col+2 < cols and colors[i+2] == color):
+            return True
+    count = 0
+    if skip != GameBoard.MOVES[0] and row >= 1 and colors[i-cols] == color:
+        count = 1
+        if row >= 2 and colors[i-2*cols] == color:
+            return True
+    if skip != GameBoard.MOVES[1] and row+1 < rows and colors[i+cols] == color:
+        if count == 1 or (row+2 < rows and colors[i+2*cols] == color):
+            return True
+    return False
+
+# Would swapping squares i and j be accepted by GameBoard.move?
+# Assumes a settled board, i.e. no match before the swap
+def swap_is_legal(cells, colors, rows, cols, i, j):
+    if j < i:
+        i, j = j, i
+    color_i = colors[i]
+    color_j = colors[j]
+    # Chocolate swaps and striped+striped swaps are always valid
+    if color_i == CHOCOLATE or color_j == CHOCOLATE:
+        return True
+    if cells[i] & STRIPED and cells[j] & STRIPED:
+        return True
+    if color_i == color_j:
+        return False
+    row, col = divmod(i, cols)
+    if j == i+1:
+        return forms_run(colors, rows, cols, row, col, color_j, GameBoard.MOVES[3]) \
+                or forms_run(colors, rows, cols, row, col+1, color_i, GameBoard.MOVES[2])
+    return forms_run(colors, rows, cols, row, col, color_j, GameBoard.MOVES[1]) \
+            or forms_run(colors, rows, cols, row+1, col, color_i, GameBoard.MOVES[0])
+
+# One Fisher-Yates pass over the candies in cells, jelly staying where it is:
+# each square in scan order takes a random candy of those not placed yet or,
+# when that one would complete a run of 3 with the two squares to its left or
+# the two above, the next of them that does not, so the result has no match
+# Returns the new cells, or None when some square fits none of the candies left
+def shuffle_candies(cells, rows, cols, rng):
+    candies = bytearray(bytes(cells).translate(CANDY_PLANE))
+    colors = bytearray(len(candies))
+    n = len(candies)
+    for i in range(n):
+        row, col = divmod(i, cols)
+        left = n - i
+        k = rng.randrange(left) if left > 1 else 0
+        for step in range(left):
+            j = i + (k+step) % left
+            color = candies[j] & COLOR_MASK
+            if color >= CHOCOLATE:
+                break
+            if col >= 2 and colors[i-1] == color and colors[i-2] == color:
+                continue
+            if row >= 2 and colors[i-cols] == color and colors[i-2*cols] == color:
+                continue
+            break
+        else:
+            return None
+        candies[i], candies[j] = candies[j], candies[i]
+        colors[i] = color
+    for i in range(n):
+        candies[i] = candies[i] | (cells[i] & JELLY)
+    return candies
+
+# Valid right/down swaps starting at the given squares, as codes square*2 (+1 for down)
+def legal_swaps(cells, rows, cols, positions):
+    colors = bytes(cells).translate(COLOR_PLANE)
+    codes = []
+    for i in positions:
+        row, col = divmod(i, cols)
+        if col+1 < cols and swap_is_legal(cells, colors, rows, cols, i, i+1):
+            codes.append(i*2)
+        if row+1 < rows and swap_is_legal(cells, colors, rows, cols, i, i+cols):
+            codes.append(i*2+1)
+    return codes
+
+# Squares whose right/down swaps can change when the dirty squares change:
+# a swap looks 2 squares along the row and column of both of its squares
+def legal_neighborhood(dirty, rows, cols):
+    near = set()
+    for i in dirty:
+        row, col = divmod(i, cols)
+        for c in range(max(0, col-2), min(cols, col+3)):
+            near.add(row*cols+c)
+        for r in range(max(0, row-2), min(rows, row+3)):
+            near.add(r*cols+col)
+    recheck = set(near)
+    for i in near:
+        if i % cols > 0:
+            recheck.add(i-1)
+        if i >= cols:
+            recheck.add(i-cols)
+    return recheck
+
+# legal_moves for many settled boards of one size at once
+# Boards are packed like heuristic_terms does, then for each color the squares
+# that would complete 3 in a row if that color moved in ("holes") are found by
+# ANDing shifted planes; a hole next to a candy of the color, outside the run
+# it would complete, is a valid swap. Chocolate swaps and striped+striped
+# swaps are always valid. Returns each board's moves in legal_moves order
+def batch_legal_moves(boards, rows, cols):
+    width = cols+1
+    size = (rows+1)*width
+    separator = b'\xff'*width
+    padded = []
+    for board in boards:
+        cells = bytes(board.encode())
+        for i in range(0, rows*cols, cols):
+            padded.append(cells[i:i+cols]+b'\xff')
+        padded.append(separator)
+    padded = b''.join(padded)
+
+    def plane(table):
+        return int.from_bytes(padded.translate(table), 'little')
+    # Plane shifted so square i holds what square i+k had
+    def at(value, k):
+        if k > 0:
+            return value >> 8*k
+        return value << -8*k
+
+    square = plane(SQUARE_PLANE)
+    valid_right = square & at(square, 1)
+    valid_down = square & at(square, width)
+    choco = plane(CHOCOLATE_PLANE)
+    striped = plane(VERTICAL_PLANE) | plane(HORIZONTAL_PLANE)
+    right = (choco | at(choco, 1)) | (striped & at(striped, 1))
+    down = (choco | at(choco, width)) | (striped & at(striped, width))
+    for table in COLOR_PLANES:
+        color = plane(table)
+        # Holes by where they sit in the run they would complete
+        row_middle = at(color, -1) & at(color, 1)
+        row_left = at(color, 1) & at(color, 2)
+        row_right = at(color, -1) & at(color, -2)
+        col_middle = at(color, -width) & at(color, width)
+        col_top = at(color, width) & at(color, 2*width)
+        col_bottom = at(color, -width) & at(color, -2*width)
+        in_row = row_middle | row_left | row_right
+        in_col = col_middle | col_top | col_bottom
+        other = square & ~color
+        # The candy moves in from the right, left, below or above
+        right = right | ((row_right | in_col) & at(color, 1) & other)
+        right = right | at((row_left | in_col) & at(color, -1) & other, 1)
+        down = down | ((col_bottom | in_row) & at(color, width) & other)
+        down = down | at((col_top | in_row) & at(color, -width) & other, width)
+    codes = ((right & valid_right) | ((down & valid_down) << 1)).to_bytes(len(padded)+1, 'little')
+
+    moves = []
+    for k in range(len(boards)):
+        board_moves = []
+        for match in MOVE_RE.finditer(codes, k*size, (k+1)*size):
+            row, col = divmod(match.start()-k*size, width)
+            code = codes[match.start()]
+            if code & 1:
+                board_moves.append((row, col, GameBoard.MOVES[3]))
+            if code & 2:
+                board_moves.append((row, col, GameBoard.MOVES[1]))
+        moves.append(board_moves)
+    return moves
+
+# GameBoard stored as one flat bytearray (see cell encoding at top of file)
+# Plays exactly the same game as GameBoard for the same random stream,
+# but a copy is a single buffer copy instead of rows*cols*2 objects
+# Cascade "scan" crushes one match per update_board like GameBoard does,
+# "wave" crushes every match on the board at once
+class ArrayGameBoard(GameBoard):
+    CASCADE = ["scan", "wave"]
+
+    def __init__(self, rows, cols, mode, cascade=None):
+        super().__init__(rows, cols, mode)
+        if cascade == None:
+            self.cascade = ArrayGameBoard.CASCADE[0]
+        elif cascade in ArrayGameBoard.CASCADE:
+            self.cascade = cascade
+        else:
+            print("ERROR: Invalid cascade: "+str(cascade))
+            raise Exception("Invalid cascade: "+str(cascade))
+
+    # The cells are the board, see GameBoard.init_cells
+    def init_squares(self):
+        self.init_cells()
+
+    def copyme(self):
+        copyTo = ArrayGameBoard(self.rows,self.cols,self.mode,self.cascade)
+        copyTo.score = self.score
+        copyTo.move_counter = self.move_counter
+        copyTo.start_time = self.start_time
+        copyTo.finish = self.finish
+        copyTo.goal_value = self.goal_value
+        copyTo.legal_cache = self.legal_cache
+        copyTo.rng = self.search_rng()
+        self.copy_refills(copyTo)
+        copyTo.jelly_mask = self.jelly_mask
+        copyTo.cells[:] = self.cells
+        copyTo.row_hash = self.row_hash[:]
+        copyTo.zhash = self.zhash
+
+        if hasattr(self, 'active_jelly'):
+            copyTo.active_jelly = self.active_jelly
+
+        return copyTo
+
+    # Replace the candy in square i, jelly stays
+    def set_candy(self, i, candy):
+        self.set_cell(i, (self.cells[i] & JELLY) | candy)
+
+    # No squares besides the cells
+    def put_cell(self, i, code):
+        self.set_cell(i, code)
+
+    def candy_at(self, row, col):
+        if row >= self.rows or col >= self.cols:
+            raise IndexError("Square out of range")
+        return decode_candy(self.cells[row*self.cols+col])
+
+    def swap_candy(self, moveFromRow, moveFromCol, moveToRow, moveToCol):
+        # Jelly stays on its square, only the candy moves
+        i = moveFromRow*self.cols+moveFromCol
+        j = moveToRow*self.cols+moveToCol
+        code_i = self.cells[i]
+        code_j = self.cells[j]
+        self.set_cell(i, (code_i & JELLY) | (code_j & CANDY_MASK))
+        self.set_cell(j, (code_j & JELLY) | (code_i & CANDY_MASK))
+
+    def start(self, goal_value):
+        # Init each square with a random Candy
+        for i in range(len(self.cells)):
+            self.set_cell(i, self.rng.randrange(len(Candy.COLORS)))
+
+        # Needed so that the initial board has no crushes when Player begins
+        res = True
+        while res == True:
+            res = self.update_board()
+
+        # If we are in jelly mode, randomly set some jelly
+        if self.mode == GameBoard.MODE[2] or self.mode == GameBoard.MODE[3]:
+            self.active_jelly = goal_value["jelly"]
+            for i in range(self.active_jelly):
+                while True:
+                    row = self.rng.randrange(self.rows)
+                    col = self.rng.randrange(self.cols)
+                    if not self.cells[row*self.cols+col] & JELLY:
+                        self.set_cell(row*self.cols+col, self.cells[row*self.cols+col] | JELLY)
+                        self.jelly_mask = self.jelly_mask | (1 << (row*self.cols+col))
+                        break
+
+        # Set/reset variables
+        self.move_counter = 0
+        self.score = 0
+        self.start_time = time.time()
+        self.finish = False
+        self.goal_value = goal_value
+
+    def move_up(self, moveRow, moveCol):
+        self.swap_move(moveRow, moveCol, moveRow-1, moveCol)
+
+    def move_down(self, moveRow, moveCol):
+        self.swap_move(moveRow, moveCol, moveRow+1, moveCol)
+
+    def move_left(self, moveRow, moveCol):
+        self.swap_move(moveRow, moveCol, moveRow, moveCol-1)
+
+    def move_right(self, moveRow, moveCol):
+        self.swap_move(moveRow, moveCol, moveRow, moveCol+1)
+
+    # Shared body of move_up/down/left/right
+    def swap_move(self, moveFromRow, moveFromCol, moveToRow, moveToCol):
+        i = moveFromRow*self.cols+moveFromCol
+        j = moveToRow*self.cols+moveToCol
+        candy1 = self.cells[i] & CANDY_MASK
+        candy2 = self.cells[j] & CANDY_MASK
+
+        # Need to check if either is a chocolate
+        if candy1 & COLOR_MASK == CHOCOLATE or candy2 & COLOR_MASK == CHOCOLATE:
+            # First remove the 2 candies and add 2 points
+            self.set_candy(i, EMPTY)
+            self.set_candy(j, EMPTY)
+            self.score = self.score + 2
+            # Now check for which combo
+            self.chocolate_combo(candy1, candy2)
+
+        # Need to check if both are striped candies
+        elif candy1 & STRIPED and candy2 & STRIPED:
+            self.set_candy(i, EMPTY)
+            self.set_candy(j, EMPTY)
+            self.stripe_combo(moveToRow, moveToCol)
+
+        # Else, just a normal move
+        else:
+            # Make sure this move matches at least 3
+            self.check_match(moveFromRow,moveFromCol,moveToRow,moveToCol)
+            self.swap_candy(moveFromRow,moveFromCol,moveToRow,moveToCol)
+
+    # Chocolate + Candy, candies given as cell codes
+    def chocolate_combo(self, candy1, candy2):
+        cells = self.cells
+
+        # If both are chocolate, clear the entire board
+        if candy1 & COLOR_MASK == CHOCOLATE and candy2 & COLOR_MASK == CHOCOLATE:
+            for i in range(len(cells)):
+                if cells[i] & COLOR_MASK != CHOCOLATE:
+                    self.set_candy(i, self.rng.randrange(len(Candy.COLORS)))
+                    self.score = self.score + 1
+                else:
+                    self.set_cell(i, cells[i] | EXPLODING)
+            return
+
+        # Else if candy1 is a candy
+        elif candy2 & COLOR_MASK == CHOCOLATE:
+            candy = candy1
+
+        # Else if candy2 is candy
+        else:
+            candy = candy2
+        color = candy & COLOR_MASK
+
+        # Chocolate + Striped Candy
+        if candy & STRIPED:
+            # Now turn every same candy into striped candy of random direction
+            colors = cells.translate(COLOR_PLANE)
+            i = colors.find(color)
+            while i != -1:
+                if self.rng.randrange(len(StripedCandy.DIR)) == 0:
+                    self.set_candy(i, color | STRIPED)
+                else:
+                    self.set_candy(i, color | STRIPED | HORIZONTAL)
+                i = colors.find(color, i+1)
+
+        # Finally, crush all the candies of the same color
+        self.crush_color(color)
+
+        self.move_and_refill()
+
+    # Same as GameBoard.crush_ranges, over the cell codes
+    def crush_ranges(self, ranges):
+        cells = self.cells
+        cols = self.cols
+        stack = crush_stack(ranges, cols)
+        cleared = {}    # Square -> True if its jelly goes too
+        specials = 0
+        while len(stack) > 0:
+            i = stack.pop()
+            code = cells[i]
+            # If no candy here, ignore
+            if code & COLOR_MASK == EMPTY or i in cleared:
+                continue
+            cleared[i] = True
+            # If this is a striped candy, crush its line next
+            if code & STRIPED:
+                specials = specials + 1
+                # If vertical striped candy
+                if not code & HORIZONTAL:
+                    stack.extend(range((self.rows-1)*cols+i % cols, -1, -cols))
+                # Else, horizontal striped candy
+                else:
+                    stack.extend(range((i // cols+1)*cols-1, (i // cols)*cols-1, -1))
+            # If this is a chocolate, destroy all same random colored candy
+            elif code & COLOR_MASK == CHOCOLATE:
+                specials = specials + 1
+                acolor = self.rng.randrange(len(Candy.COLORS))
+                colors = cells.translate(COLOR_PLANE)
+                j = colors.find(acolor)
+                while j != -1:
+                    if j not in cleared:
+                        cleared[j] = False
+                    j = colors.find(acolor, j+1)
+
+        for i in cleared:
+            # If jelly here, eliminate it
+            if cleared[i]:
+                if cells[i] & JELLY:
+                    self.active_jelly = self.active_jelly - 1
+                    self.jelly_mask = self.jelly_mask & ~(1 << i)
+                self.set_cell(i, EMPTY)
+            else:
+                self.set_candy(i, EMPTY)
+        self.score = self.score + len(cleared)
+        self.cells_cleared = self.cells_cleared + len(cleared)
+        self.specials_triggered = self.specials_triggered + specials
+
+    def clear_squares(self, mask):
+        while mask != 0:
+            i = (mask & -mask).bit_length()-1
+            self.set_cell(i, EMPTY)
+            mask = mask & (mask-1)
+
+    def find_matches(self):
+        return find_matches(self.cells, self.rows, self.cols)
+
+    def check_valid_move(self):
+        return len(self.find_matches()) > 0
+
+    # Crush the matches on the board and refill
+    # Return True if there was a crush, False otherwise
+    def update_board(self):
+        matches = self.find_matches()
+        if len(matches) == 0:
+            return False
+
+        if self.cascade == ArrayGameBoard.CASCADE[0]:
+            # Only the first match, at most 5 long, as check_right/check_down would
+            row, col, direction, length, color = matches[0]
+            matches = [(row, col, direction, min(length, 5), color)]
+
+        # Crush every match before forming special candies so a new
+        # special candy is not set off by another match of the same wave
+        self.crush_ranges([self.match_range(match) for match in matches])
+        for match in matches:
+            self.form_special(match)
+
+        self.move_and_refill()
+        return True
+
+    # Squares of a match as a crush_ranges range
+    def match_range(self, match):
+        row, col, direction, length, color = match
+        if direction == GameBoard.MOVES[3]:
+            return (row,col,row,col+length-1)
+        elif direction == GameBoard.MOVES[1]:
+            return (row,col,row+length-1,col)
+        else:
+            return (row,col,row,col)
+
+    # Match 4 forms a striped candy and match 5+ a chocolate, in the same
+    # square and direction as check_right/check_down
+    def form_special(self, match):
+        row, col, direction, length, color = match
+        if direction == None or length < 4:
+            return
+        if direction == GameBoard.MOVES[3]:
+            i = row*self.cols+col
+            stripe = STRIPED
+        else:
+            i = (row+length-1)*self.cols+col
+            stripe = STRIPED | HORIZONTAL
+        # Another match of this wave may already have formed a candy here
+        if self.cells[i] & COLOR_MASK != EMPTY:
+            return
+        if length == 4:
+            self.set_candy(i, color | stripe)
+        else:
+            self.set_candy(i, CHOCOLATE)
+
+    # GameBoard.move_and_refill on all columns at once: one translate finds
+    # the empty squares of the whole board, columns without any are skipped,
+    # and each other column is compacted with slice operations; only squares
+    # whose candy changes are written
+    def move_and_refill(self):
+        cells = self.cells
+        cols = self.cols
+        colors = cells.translate(COLOR_PLANE)
+        if colors.find(EMPTY) == -1:
+            return
+        gaps = []   # Empty squares at the top of each column
+        for col in range(cols):
+            column = colors[col::cols]
+            gap = column.count(EMPTY)
+            gaps.append(gap)
+            if gap == 0:
+                continue
+            candies = cells[col::cols].translate(CANDY_PLANE)
+            # Rows below the lowest empty square keep their candies
+            bottom = column.rfind(EMPTY)
+            dropped = candies[:bottom+1].translate(None, EMPTY_CANDY)
+            for row in range(gap, bottom+1):
+                if candies[row] != dropped[row-gap]:
+                    self.set_candy(row*cols+col, dropped[row-gap])
+        # Create new random candies
+        for row in range(max(gaps)-1,-1,-1):
+            for col in range(cols-1,-1,-1):
+                if row < gaps[col]:
+                    self.set_candy(row*cols+col, self.refill_color(col))
+
+    def print_board(self):
+        for row in range(self.rows):
+            for col in range(self.cols):
+                print(self.print_square(row,col).rjust(3), end=" ")
+            print()
+
+    # Same text as Square.print_square for the square at (row,col)
+    def print_square(self, row, col):
+        code = self.cells[row*self.cols+col]
+        color = code & COLOR_MASK
+        if color == EMPTY:
+            text = "_"
+        elif color == CHOCOLATE:
+            text = "C"
+        elif code & STRIPED:
+            if code & HORIZONTAL:
+                text = Candy.COLORS[color]+"H"
+            else:
+                text = Candy.COLORS[color]+"V"
+        else:
+            text = Candy.COLORS[color]
+        if code & JELLY:
+            text = text+"J"
+        return text
 
 class Square:
-    def __init__(self):
+    __slots__ = ("jelly", "candy")
+
+    def __init__(self, candy=None):
         self.jelly = False
-        self.candy = Candy()    # Init with random Candy
+        if candy == None:
+            self.candy = Candy()    # Init with random Candy
+        else:
+            self.candy = candy
 
+    # Copies never draw a throwaway random Candy
     def copyme(self):
-        copyTo = Square()
+        copyTo = Square(self.candy.copyme())
         copyTo.jelly = self.jelly
-        copyTo.candy = self.candy.copyme()
         return copyTo
 
-    def set_jelly(self):
-        if self.jelly == False:
-            self.jelly = True
-        else:
-            raise Exception("Already jellied")
-
     def print_square(self):
         if self.jelly == True:
             if self.candy != None:
@@ -1051,27 +2880,11 @@ class Square:
         else:
             return "_"
 
-    def set_candy(self, color=None):
-        if self.candy != None:
-            raise Exception("Overriding candy")
-
-        self.candy = Candy(color)
-
-    def set_striped_candy(self, color=None, direction=None):
-        if self.candy != None:
-            raise Exception("Overriding candy")
-
-        self.candy = StripedCandy(color, direction)
-
-    def set_chocolate(self):
-        if self.candy != None:
-            raise Exception("Overriding candy")
-        
-        self.candy = Chocolate()
-
+# A Candy or StripedCandy never changes once made, so copies share it
 class Candy:
     #COLORS = ["R", "G", "B"]
     COLORS = ["R", "G", "B", "O", "Y", "P"]
+    __slots__ = ("color",)
 
     def __init__(self, color=None):
         # If no color specified, make it a random color
@@ -1085,14 +2898,14 @@ class Candy:
             raise Exception("Not a valid color type: "+str(color))
 
     def copyme(self):
-        copyTo = Candy(self.color)
-        return copyTo
+        return self
         
     def print_color(self):
         return self.color
 
 class StripedCandy(Candy):
     DIR = ["v", "h"]
+    __slots__ = ("direction",)
 
     def __init__(self, color=None, direction=None):
         super().__init__(color)
@@ -1107,8 +2920,7 @@ class StripedCandy(Candy):
             raise Exception("Not a valid striped candy direction")
 
     def copyme(self):
-        copyTo = StripedCandy(self.color,self.direction)
-        return copyTo
+        return self
 
     def print_color(self):
         if self.direction == StripedCandy.DIR[0]:
@@ -1117,7 +2929,11 @@ class StripedCandy(Candy):
             return self.color+"H"
 
 # Chocolate has its own unique "color" (really all colors)
+# An exploding one is a new Chocolate (see GameBoard.set_square), never
+# set in place, but a copy still gets its own
 class Chocolate:
+    __slots__ = ("color", "exploding")
+
     def __init__(self):
         self.color = "C"
         self.exploding = False  # Lets game know to crush this asap
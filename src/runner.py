@@ -4,7 +4,250 @@
     E-mail: gmcadams1@comcast.net
 """
 import math
-from src.cc_simulator import Driver
+import heapq
+import json
+import array
+import concurrent.futures
+from src.cc_simulator import Driver, RandomBatch, ArrayGameBoard, Profile, start_profile, stop_profile
+
+# Play one game for a seed with the tester's settings
+# Module level so it can run in a process pool
+# Returns the game's result, its move records (None unless the tester logs)
+# and the transposition table to hand to the next game
+# With tester.profile the result carries the game's Profile under "profile";
+# the profiled functions are put back even if the game raises
+def run_game(tester, seed, stored_states=None):
+    if tester.profile == True:
+        start_profile()
+    try:
+        test = Driver(seed, tester.rng)
+        test.append_game(tester.height,tester.width,tester.mode,tester.engine)
+        table = None
+        if tester.issmart == True and tester.player == "mcts":
+            test.append_player("mcts",rollouts=tester.rollouts,time_limit=tester.time_limit,
+                    rollout_depth=tester.rollout_depth)
+        elif tester.issmart == True:
+            test.append_player("ai",tester.depth_limit,tester.beam_width,tester.search_workers,tester.table_size,tester.search,
+                    time_limit=tester.time_limit,reuse_tree=tester.reuse_tree,objective=tester.objective)
+            if stored_states != None:
+                test.players[0].stored_states = stored_states
+            table = test.players[0].stored_states
+            if table != None:
+                counters = (table.hits, table.misses, table.evictions)
+        else:
+            test.append_player("random")
+        moves = None
+        if tester.log_path != None:
+            moves = []
+            test.players[0].move_log = moves
+        test.play_game(0,0,tester.goals)
+        result = new_result(seed, test.gameBoards[0])
+        if tester.issmart == True:
+            result["num_children"] = test.players[0].num_children
+            result["nodes"] = test.players[0].nodes_expanded
+        if tester.issmart == True and tester.player == "mcts":
+            result["rollouts"] = test.players[0].total_rollouts
+            result["search_time"] = test.players[0].search_time
+        elif tester.issmart == True:
+            result["depth"] = test.players[0].total_depth
+            result["tree_hits"] = test.players[0].tree_hits
+            result["tree_misses"] = test.players[0].tree_misses
+            stored_states = test.players[0].stored_states
+            # This game's share of a table that may be shared across games
+            if table != None:
+                result["table_hits"] = table.hits - counters[0]
+                result["table_misses"] = table.misses - counters[1]
+                result["table_evictions"] = table.evictions - counters[2]
+    finally:
+        if tester.profile == True:
+            profile = stop_profile()
+    if tester.profile == True:
+        result["profile"] = profile
+    return result, moves, stored_states
+
+# Result of a finished game; players fill in their own counters
+# Jelly cleared is 1 for a game in a jelly mode that cleared all its jelly
+def new_result(seed, board):
+    jelly_left = getattr(board, 'active_jelly', 0)
+    jelly_cleared = 0
+    if hasattr(board, 'active_jelly') and jelly_left == 0:
+        jelly_cleared = 1
+    return {"seed":seed,
+            "score":board.score,
+            "moves":board.move_counter,
+            "time":board.time_elapsed,
+            "jelly_left":jelly_left,
+            "jelly_cleared":jelly_cleared,
+            "num_children":0,
+            "table_hits":0,
+            "table_misses":0,
+            "table_evictions":0,
+            "rollouts":0,
+            "search_time":0,
+            "nodes":0,
+            "depth":0,
+            "tree_hits":0,
+            "tree_misses":0}
+
+# Random player games for a list of seeds, played together as a RandomBatch
+# Returns (result, move records) per game in seed order; the games are the
+# ones run_game plays on the array engine
+# With tester.profile the batch's Profile goes with the first game's result
+def run_batch(tester, seeds):
+    if tester.profile == True:
+        start_profile()
+    try:
+        cascade = None
+        if tester.engine == "array+wave":
+            cascade = ArrayGameBoard.CASCADE[1]
+        batch = RandomBatch(tester.height, tester.width, tester.mode, seeds, tester.goals, cascade, tester.rng)
+        if tester.log_path != None:
+            batch.log_moves()
+        boards = batch.play()
+        games = []
+        for k in range(len(boards)):
+            result = new_result(batch.seeds[k], boards[k])
+            moves = None
+            if batch.move_logs != None:
+                moves = batch.move_logs[k]
+            games.append((result, moves))
+    finally:
+        if tester.profile == True:
+            profile = stop_profile()
+    if tester.profile == True:
+        games[0][0]["profile"] = profile
+    return games
+
+# Median of a stream of numbers: the lower half in a max-heap (negated) and the
+# upper half in a min-heap, so the median is the top of the upper half
+# Same value as sorted(values)[len(values)//2]
+class RunningMedian:
+    def __init__(self):
+        self.lower = []
+        self.upper = []
+
+    def add(self, value):
+        if len(self.upper) > 0 and value < self.upper[0]:
+            heapq.heappush(self.lower, -value)
+        else:
+            heapq.heappush(self.upper, value)
+        # Keep len(lower) == n//2
+        if len(self.lower) > len(self.upper):
+            heapq.heappush(self.upper, -heapq.heappop(self.lower))
+        elif len(self.upper) > len(self.lower)+1:
+            heapq.heappush(self.lower, -heapq.heappop(self.upper))
+
+    def median(self):
+        return self.upper[0]
+
+    def __len__(self):
+        return len(self.lower) + len(self.upper)
+
+# Running totals of finished games for AITester.print_stats
+# The score variance is kept with Welford's update, so nothing per game is stored
+class GameStats:
+    FIELDS = ["score", "moves", "time", "jelly_left", "jelly_cleared", "num_children", "table_hits", "table_misses", "table_evictions",
+              "rollouts", "search_time", "nodes", "depth",
+              "tree_hits", "tree_misses"]
+
+    def __init__(self):
+        self.count = 0
+        self.totals = {}
+        for field in GameStats.FIELDS:
+            self.totals[field] = 0
+        self.mean_score = 0
+        self.score_m2 = 0
+        self.median = RunningMedian()
+
+    def add(self, result):
+        self.count = self.count + 1
+        for field in GameStats.FIELDS:
+            self.totals[field] = self.totals[field] + result[field]
+        delta = result["score"] - self.mean_score
+        self.mean_score = self.mean_score + delta/self.count
+        self.score_m2 = self.score_m2 + delta*(result["score"]-self.mean_score)
+        self.median.add(result["score"])
+
+    def average(self, field):
+        return self.totals[field]/self.count
+
+    # Total of field per move played, 0 when no game made a move
+    def per_move(self, field):
+        if self.totals["moves"] == 0:
+            return 0
+        return self.totals[field]/self.totals["moves"]
+
+    # Population standard deviation, as print_stats always reported
+    def std_dev(self):
+        return math.sqrt(self.score_m2/self.count)
+
+# Streaming sink for per-move and per-game records
+# "jsonl" writes one JSON object per line with a "type" of "move" or "game"
+# "binary" writes fixed records of RECORD_SIZE doubles: a type code (0 move,
+# 1 game) then the fields in MOVE_FIELDS or GAME_FIELDS order, zero padded
+class ResultLog:
+    FORMAT = ["jsonl", "binary"]
+    MOVE_FIELDS = ["seed", "move", "score_delta", "cascade_depth", "cells_cleared", "specials", "nodes", "depth", "time"]
+    GAME_FIELDS = ["seed", "score", "moves", "time", "jelly_left", "jelly_cleared", "num_children", "table_hits", "table_misses", "table_evictions",
+                   "rollouts", "search_time", "nodes", "depth",
+                   "tree_hits", "tree_misses"]
+    RECORD_SIZE = 1 + max(len(MOVE_FIELDS), len(GAME_FIELDS))
+
+    def __init__(self, path, log_format=None):
+        if log_format == None:
+            self.format = ResultLog.FORMAT[0]
+        elif log_format in ResultLog.FORMAT:
+            self.format = log_format
+        else:
+            print("ERROR: Invalid log format: "+str(log_format))
+            raise Exception("Invalid log format: "+str(log_format))
+        if self.format == ResultLog.FORMAT[0]:
+            self.file = open(path, "a")
+        else:
+            self.file = open(path, "ab")
+
+    # Records of one finished game: its moves, then the game itself
+    def write_game(self, result, moves):
+        if moves != None:
+            for move in moves:
+                move["seed"] = result["seed"]
+                self.write(0, "move", ResultLog.MOVE_FIELDS, move)
+        self.write(1, "game", ResultLog.GAME_FIELDS, result)
+        self.file.flush()
+
+    def write(self, code, name, fields, record):
+        if self.format == ResultLog.FORMAT[0]:
+            line = {"type":name}
+            for field in fields:
+                line[field] = record[field]
+            self.file.write(json.dumps(line)+"\n")
+        else:
+            values = array.array('d', [code]+[record[field] for field in fields])
+            values.extend([0]*(ResultLog.RECORD_SIZE-len(values)))
+            values.tofile(self.file)
+
+    def close(self):
+        self.file.close()
+
+# Records of a log written by ResultLog, as dicts with a "type" key
+def read_log(path, log_format=None):
+    if log_format == None or log_format == ResultLog.FORMAT[0]:
+        with open(path) as f:
+            for line in f:
+                yield json.loads(line)
+    else:
+        values = array.array('d')
+        with open(path, "rb") as f:
+            values.frombytes(f.read())
+        for i in range(0, len(values), ResultLog.RECORD_SIZE):
+            if values[i] == 0:
+                name, fields = "move", ResultLog.MOVE_FIELDS
+            else:
+                name, fields = "game", ResultLog.GAME_FIELDS
+            record = {"type":name}
+            for j in range(len(fields)):
+                record[fields[j]] = values[i+1+j]
+            yield record
 
 class AITester:
     def __init__(self, num_runs, goals, width, height, depth_limit, beam_width):
@@ -14,74 +257,174 @@ class AITester:
         self.goals = goals
         self.width = width
         self.height = height
-        self.final_boards = []
+        self.mode = "main"  # Game mode, see GameBoard.MODE; goals needs its keys
+        self.first_seed = 1 # Games are seeded first_seed, first_seed+1, ...
+        self.stats = GameStats()    # Totals over finished games, see run_game
         self.issmart = True
-    
+        self.player = "ai"  # Smart player: "ai" (beam search) or "mcts"
+        self.rollouts = 100 # MCTS rollouts per move, None for no limit
+        self.rollout_depth = None   # Random moves per MCTS rollout, see MCTSPlayer.ROLLOUT_DEPTH
+        self.time_limit = None  # Smart player's seconds per move, None for no limit
+        self.engine = "object"  # Board representation, see Driver.ENGINE
+        self.rng = "shared" # Where boards draw random numbers from, see Driver.RNG
+        self.search_workers = 1    # Processes used by the AI player's search
+        self.game_workers = 1   # Processes playing games side by side
+        self.table_size = 0   # States kept in the AI player's transposition table, 0 for none
+        self.search = "tree"   # How the AI player walks its tree, see AIPlayer.SEARCH
+        self.reuse_tree = False   # AI player keeps the played move's subtree, see AIPlayer.init_tree
+        self.objective = None   # What the AI player's heuristic goes for, see AIPlayer.OBJECTIVE
+        self.log_path = None   # File to stream move and game records to, see ResultLog
+        self.log_format = "jsonl"
+        self.batch_size = 0   # Random player games per RandomBatch, 0 to play them one by one
+        self.profile = False    # Count hot path calls and search levels, see cc_simulator.Profile
+        self.profile_path = None   # File to write the profile to as JSON instead of printing it
+        self.profile_totals = Profile() # Sum of the finished games' profiles
+
     def start(self):
-        score = 0
-        moves = 0
-        time_elapsed = 0
-        seed = 0
-        num_children = 0
-        if self.issmart == True:
-            stored_states = None
-            for i in range(self.num_runs):
-                print("Starting Run #"+str(i+1))
-                seed = seed + 1
-                test = Driver(seed)
-                test.append_game(self.height,self.width,"main")
-                test.append_player("ai",self.depth_limit,self.beam_width)
-                if stored_states != None:
-                    test.players[0].stored_states = stored_states
-                test.play_game(0,0,self.goals)
-                num_children = num_children + test.players[0].num_children
-                if stored_states == None:
-                    stored_states = test.players[0].stored_states
-                score = score + test.gameBoards[0].score
-                moves = moves + test.gameBoards[0].move_counter
-                time_elapsed = time_elapsed + test.gameBoards[0].time_elapsed
-                self.final_boards.append(test.gameBoards[0])
-                avg_score = score/len(self.final_boards)
-                print("Average Score: "+str(avg_score))
-                #print("Average Time: "+str(time_elapsed/len(self.final_boards)))
-                #print("Length of stored states: "+str(len(stored_states)))
-                #print("Hash hits: "+str(test.players[0].hash_hits))
+        seeds = range(self.first_seed,self.first_seed+self.num_runs)
+        if self.issmart == True and self.player != "mcts" and self.table_size > 0 and self.rng == "shared":
+            print("WARNING: The transposition table has no effect on the shared random stream, use rng board or known")
+        # Kept off the tester, which is sent to the game workers
+        log = None
+        if self.log_path != None:
+            log = ResultLog(self.log_path, self.log_format)
+        if self.issmart == False and self.batch_size > 0:
+            self.run_batched(seeds, log)
+        elif self.game_workers > 1:
+            self.run_parallel(seeds, log)
+        else:
+            self.run_serial(seeds, log)
+        if log != None:
+            log.close()
+        self.print_stats()
+
+    # One game is done: stream it out and fold it into the totals
+    def finish_game(self, result, moves, log):
+        if "profile" in result:
+            self.profile_totals.merge(result.pop("profile"))
+        if log != None:
+            log.write_game(result, moves)
+        self.stats.add(result)
+
+    def run_serial(self, seeds, log=None):
+        stored_states = None
+        for i in range(len(seeds)):
+            print("Starting Run #"+str(i+1))
+            result, moves, stored_states = run_game(self, seeds[i], stored_states)
+            self.finish_game(result, moves, log)
+            if self.issmart == True:
+                print("Average Score: "+str(self.stats.average("score")))
+
+    # Games are independent and each reseeds through Driver(seed),
+    # so a pool plays exactly the games the serial loop would
+    def run_parallel(self, seeds, log=None):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.game_workers) as pool:
+            futures = [pool.submit(run_game, self, seed) for seed in seeds]
+            print("Started "+str(len(futures))+" runs on "+str(self.game_workers)+" workers")
+            for future in concurrent.futures.as_completed(futures):
+                result, moves = future.result()[:2]
+                self.finish_game(result, moves, log)
+                print("Finished Run #"+str(result["seed"])+" Score: "+str(result["score"]))
+                print("Average Score: "+str(self.stats.average("score")))
+
+    # Random games batch_size seeds at a time, batches spread over the game workers
+    # The boards are array boards whatever the engine, see RandomBatch
+    def run_batched(self, seeds, log=None):
+        batches = [seeds[i:i+self.batch_size] for i in range(0, len(seeds), self.batch_size)]
+        if self.game_workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.game_workers) as pool:
+                futures = [pool.submit(run_batch, self, batch) for batch in batches]
+                print("Started "+str(len(futures))+" batches on "+str(self.game_workers)+" workers")
+                for future in concurrent.futures.as_completed(futures):
+                    self.finish_batch(future.result(), log)
         else:
-             for i in range(self.num_runs):
-                print("Starting Run #"+str(i+1))
-                seed = seed + 1
-                test = Driver(seed)
-                test.append_game(self.height,self.width,"main")
-                test.append_player("random")
-                test.play_game(0,0,self.goals)
-                score = score + test.gameBoards[0].score
-                moves = moves + test.gameBoards[0].move_counter
-                time_elapsed = time_elapsed + test.gameBoards[0].time_elapsed
-                self.final_boards.append(test.gameBoards[0])
-                avg_score = score/len(self.final_boards)
-
-        # Average stats
-        std_dev = 0
-        children = 0
-        for i in self.final_boards:
-            std_dev = std_dev + math.pow(i.score-avg_score,2)
-        std_dev = std_dev / len(self.final_boards)
-        std_dev = math.sqrt(std_dev)
+            for batch in batches:
+                print("Starting Runs #"+str(batch[0])+"-#"+str(batch[-1]))
+                self.finish_batch(run_batch(self, batch), log)
+
+    def finish_batch(self, games, log):
+        for result, moves in games:
+            self.finish_game(result, moves, log)
+        print("Finished Runs #"+str(games[0][0]["seed"])+"-#"+str(games[-1][0]["seed"]))
+        print("Average Score: "+str(self.stats.average("score")))
+
+    def print_stats(self):
+        stats = self.stats
 
         #conf_low = math.sqrt( ((self.num_runs-1)*math.pow(std_dev,2))/(math.pow(avg_score,2)*((1-0.95)/2)) )
         #conf_high = math.sqrt( ((self.num_runs-1)*math.pow(std_dev,2))/(math.pow(avg_score,2)*((1+0.95)/2)) )
 
         print("Board Size: "+str(self.width)+","+str(self.height))
+        print("Mode: "+self.mode)
         print("Depth Limit: "+str(self.depth_limit))
         print("Beam Width: "+str(self.beam_width))
-        print("Average # Children: "+str(num_children/(self.goals["moves"]*self.num_runs)))
-        print("Average Score: "+str(avg_score))
-        print("Std Dev. Score: "+str(std_dev))
+        print("Average # Children: "+str(stats.per_move("num_children")))
+        print("Average Score: "+str(stats.average("score")))
+        print("Std Dev. Score: "+str(stats.std_dev()))
         #print("95% Confidence: ("+str(conf_high)+","+str(conf_low)+")")
-        print("Average Moves: "+str(moves/len(self.final_boards)))
-        print("Average Time: "+str(time_elapsed/len(self.final_boards)))
-        self.final_boards.sort(key=lambda final_board: final_board.score)
-        print("Median Score: "+str(self.final_boards[int(len(self.final_boards)/2)].score))
+        print("Average Moves: "+str(stats.average("moves")))
+        if self.mode == "jelly" or self.mode == "main+jelly":
+            print("Average Jelly Left: "+str(stats.average("jelly_left")))
+            print("Jelly Cleared: "+str(stats.totals["jelly_cleared"])+" of "+str(stats.count)+" games")
+        print("Average Time: "+str(stats.average("time")))
+        if self.issmart == True:
+            print("Average Nodes Expanded: "+str(stats.per_move("nodes")))
+        if self.issmart == True and self.player != "mcts":
+            print("Average Depth Reached: "+str(stats.per_move("depth")))
+        if self.issmart == True and self.player == "mcts":
+            print("Rollouts: "+str(stats.totals["rollouts"]))
+            if stats.totals["search_time"] > 0:
+                print("Rollouts/sec: "+str(stats.totals["rollouts"]/stats.totals["search_time"]))
+        if self.issmart == True and self.player != "mcts" and self.table_size > 0 and self.rng != "shared":
+            print("Table Hits: "+str(stats.totals["table_hits"]))
+            print("Table Misses: "+str(stats.totals["table_misses"]))
+            print("Table Evictions: "+str(stats.totals["table_evictions"]))
+        if self.issmart == True and self.player != "mcts" and self.reuse_tree == True:
+            print("Tree Reuse Hits: "+str(stats.totals["tree_hits"]))
+            print("Tree Reuse Misses: "+str(stats.totals["tree_misses"]))
+        print("Median Score: "+str(stats.median.median()))
+        if self.profile == True:
+            self.print_profile()
+
+    # Averages of the finished games' results as a plain dict, e.g. for json.dump
+    def summary(self):
+        stats = self.stats
+        summary = {"games":stats.count,
+                   "std_dev_score":stats.std_dev(),
+                   "median_score":stats.median.median()}
+        for field in GameStats.FIELDS:
+            summary[field] = stats.average(field)
+        return summary
+
+    def print_profile(self):
+        report = self.profile_totals.report()
+        if self.profile_path != None:
+            with open(self.profile_path, "w") as f:
+                json.dump(report, f, indent=2)
+            print("Profile written to "+self.profile_path)
+            return
+        print("Profile (calls, seconds):")
+        functions = report["functions"]
+        for name in sorted(functions, key=lambda name: functions[name]["time"], reverse=True):
+            print("  "+name+": "+str(functions[name]["calls"])+", "+str(functions[name]["time"]))
+        print("Cascade Depth (moves):")
+        for depth in report["cascade_depth"]:
+            print("  "+depth+": "+str(report["cascade_depth"][depth]))
+        cascades = report["cascades"]
+        print("Cascade Waves: "+str(cascades["waves"]))
+        print("Squares Cleared: "+str(cascades["cells_cleared"])+" ("+str(cascades["cells_per_wave"])+" per wave)")
+        print("Specials Triggered: "+str(cascades["specials_triggered"]))
+        if len(report["shuffle_retries"]) > 0:
+            print("Shuffle Retries (shuffles):")
+            for retries in report["shuffle_retries"]:
+                print("  "+retries+": "+str(report["shuffle_retries"][retries]))
+        if len(report["levels"]) > 0:
+            print("Search Levels (expanded, generated, kept):")
+            for level in report["levels"]:
+                counts = report["levels"][level]
+                print("  "+level+": "+str(counts["expanded"])+", "+str(counts["generated"])+", "+str(counts["kept"]))
+            print("Branching Factor: "+str(report["branching"]))
+            print("Effective Branching Factor: "+str(report["effective_branching"]))
 
 if __name__ == "__main__":
     test = AITester(10,{"score":5000000,"moves":5},10,10,3,9)
@@ -0,0 +1,183 @@
+"""
+    Filename: sweep.py
+    Author: Gregory McAdams
+    E-mail: gmcadams1@comcast.net
+"""
+import os
+import json
+import hashlib
+import itertools
+import contextlib
+import concurrent.futures
+from src.runner import AITester
+
+# Settings of one AITester run; a sweep config may give any of them
+# depth_limit 0 is no limit (with a time limit), rollouts and time_limit 0 none
+SETTINGS = {"player":"ai",  # "ai", "mcts" or "random"
+            "games":1,
+            "first_seed":1,
+            "moves":20,
+            "score_goal":5000000,
+            "jelly":10,     # Jelly squares in the jelly modes
+            "time_goal":60, # Seconds in "time" mode
+            "rows":9,
+            "cols":9,
+            "mode":"main",
+            "engine":"object",
+            "rng":"shared",
+            "depth_limit":3,
+            "beam_width":9,
+            "search":"tree",
+            "search_workers":1,
+            "game_workers":1,
+            "table_size":0,
+            "reuse_tree":False,
+            "objective":None,   # AI heuristic, None to go by the mode (see AIPlayer.OBJECTIVE)
+            "time_limit":0,
+            "rollouts":100,
+            "rollout_depth":None,   # None for MCTSPlayer.ROLLOUT_DEPTH, 0 to the end of the game
+            "batch_size":0,
+            "log_path":None,
+            "profile":False,
+            "profile_path":None}
+
+# AITester for a dict of SETTINGS (missing ones take the defaults)
+def new_tester(settings):
+    for name in settings:
+        if name not in SETTINGS:
+            print("ERROR: Unknown setting: "+str(name))
+            raise Exception("Unknown setting: "+str(name))
+    config = dict(SETTINGS)
+    config.update(settings)
+    goals = {"score":config["score_goal"], "moves":config["moves"],
+             "jelly":config["jelly"], "time":config["time_goal"]}
+    depth_limit = config["depth_limit"] if config["depth_limit"] > 0 else None
+    tester = AITester(config["games"], goals, config["cols"], config["rows"], depth_limit, config["beam_width"])
+    tester.first_seed = config["first_seed"]
+    tester.mode = config["mode"]
+    tester.engine = config["engine"]
+    tester.rng = config["rng"]
+    tester.issmart = config["player"] != "random"
+    if config["player"] == "mcts":
+        tester.player = "mcts"
+    tester.rollouts = config["rollouts"] if config["rollouts"] > 0 else None
+    tester.rollout_depth = config["rollout_depth"]
+    tester.time_limit = config["time_limit"] if config["time_limit"] > 0 else None
+    tester.search = config["search"]
+    tester.search_workers = config["search_workers"]
+    tester.game_workers = config["game_workers"]
+    tester.table_size = config["table_size"]
+    tester.reuse_tree = config["reuse_tree"]
+    tester.objective = config["objective"]
+    tester.batch_size = config["batch_size"]
+    tester.log_path = config["log_path"]
+    if tester.log_path != None and tester.log_path.endswith(".bin"):
+        tester.log_format = "binary"
+    tester.profile = config["profile"]
+    tester.profile_path = config["profile_path"]
+    return tester
+
+# Play one cell of a sweep, its printed output going to a .log next to the
+# result; the .json is written last (renamed into place), so a cell with a
+# result on disk is complete
+def run_cell(cell, path):
+    with open(path+".log", "w") as out:
+        with contextlib.redirect_stdout(out):
+            tester = new_tester(cell)
+            tester.start()
+    summary = tester.summary()
+    with open(path+".json.tmp", "w") as f:
+        json.dump({"cell":cell, "summary":summary}, f, indent=2)
+    os.replace(path+".json.tmp", path+".json")
+    return summary
+
+# Grid of AITester runs from a config dict: every setting in GRID may be a list
+# of values and the sweep plays every combination, each one a cell; the other
+# SETTINGS keys hold one value for all cells
+# "size" is a rows x cols pair (or one number for a square board) and "seeds"
+# a [first, last] range, so both are given as lists of those
+# Cells run side by side on "jobs" processes; results go to "out", one file per
+# cell, and cells already there are skipped, so a stopped sweep picks up again
+class Sweep:
+    GRID = ["depth_limit", "beam_width", "size", "mode", "objective", "seeds"]
+
+    def __init__(self, config):
+        self.config = dict(config)
+        self.jobs = self.config.pop("jobs", 1)
+        self.out = self.config.pop("out", "sweep")
+        self.axes = {}
+        for name in Sweep.GRID:
+            values = self.config.pop(name, None)
+            if values == None:
+                continue
+            if not isinstance(values, list) or (name == "seeds" and not isinstance(values[0], list)):
+                values = [values]
+            self.axes[name] = values
+
+    # Settings of every cell, in grid order
+    def cells(self):
+        names = list(self.axes)
+        cells = []
+        for values in itertools.product(*[self.axes[name] for name in names]):
+            cell = dict(self.config)
+            for name, value in zip(names, values):
+                if name == "size":
+                    if isinstance(value, list):
+                        cell["rows"], cell["cols"] = value
+                    else:
+                        cell["rows"], cell["cols"] = value, value
+                elif name == "seeds":
+                    cell["first_seed"] = value[0]
+                    cell["games"] = value[1]-value[0]+1
+                else:
+                    cell[name] = value
+            cells.append(cell)
+        return cells
+
+    # Readable settings, then a hash of all of them: a cell played with any
+    # other setting (engine, rng, moves, ...) gets a file of its own
+    def cell_name(self, cell):
+        config = dict(SETTINGS)
+        config.update(cell)
+        digest = hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:8]
+        name = config["player"]+"_"+config["mode"]+"_"+str(config["rows"])+"x"+str(config["cols"])
+        if config["player"] == "ai":
+            name = name+"_d"+str(config["depth_limit"])+"_b"+str(config["beam_width"])
+            if config["objective"] != None:
+                name = name+"_"+config["objective"]
+        return name+"_s"+str(config["first_seed"])+"-"+str(config["first_seed"]+config["games"]-1)+"_"+digest
+
+    # Returns {cell name: summary} for every cell, read back for skipped ones;
+    # all of them are also written to sweep.json in the output directory
+    def run(self):
+        os.makedirs(self.out, exist_ok=True)
+        results = {}
+        todo = []
+        cells = self.cells()
+        for cell in cells:
+            name = self.cell_name(cell)
+            path = os.path.join(self.out, name)
+            if os.path.exists(path+".json"):
+                with open(path+".json") as f:
+                    results[name] = json.load(f)["summary"]
+                print("Skipping "+name+", already done")
+            else:
+                todo.append((name, cell, path))
+        print("Running "+str(len(todo))+" of "+str(len(cells))+" cells on "+str(self.jobs)+" jobs")
+        if self.jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as pool:
+                futures = {}
+                for name, cell, path in todo:
+                    futures[pool.submit(run_cell, cell, path)] = name
+                for future in concurrent.futures.as_completed(futures):
+                    self.finish_cell(results, futures[future], future.result())
+        else:
+            for name, cell, path in todo:
+                self.finish_cell(results, name, run_cell(cell, path))
+        with open(os.path.join(self.out, "sweep.json"), "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return results
+
+    def finish_cell(self, results, name, summary):
+        results[name] = summary
+        print("Finished "+name+" Average Score: "+str(summary["score"]))
@@ -0,0 +1,34 @@
+import unittest
+from src.cc_simulator import Driver
+
+class EnginesTest(unittest.TestCase):
+    # Moves played and final score of a seeded game
+    def play(self, engine, rng, player, mode="main"):
+        test = Driver(3, rng)
+        test.append_game(7, 7, mode, engine)
+        if player == "ai":
+            test.append_player("ai", 2, 6)
+        else:
+            test.append_player(player)
+        player = test.players[0]
+        moves = []
+        next_move = player.next_move
+        def record():
+            next_move()
+            moves.append((player.gameBoard.last_move, player.gameBoard.score))
+        player.next_move = record
+        test.play_game(0, 0, {"score":10**9, "moves":12, "jelly":10})
+        return moves, test.gameBoards[0].score
+
+    # "array+wave" crushes matches in another order, so it plays its own game
+    def test_engines_play_the_same_game(self):
+        for rng in Driver.RNG:
+            for player in ["random", "ai"]:
+                for mode in ["main", "jelly"]:
+                    with self.subTest(rng=rng, player=player, mode=mode):
+                        game = self.play("object", rng, player, mode)
+                        self.assertGreater(len(game[0]), 0)
+                        self.assertEqual(self.play("array", rng, player, mode), game)
+
+if __name__ == "__main__":
+    unittest.main()
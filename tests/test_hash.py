@@ -0,0 +1,51 @@
+import random
+import unittest
+from src.cc_simulator import GameBoard, ArrayGameBoard, encode_candy, zobrist_hash, zobrist_rows, JELLY
+
+class HashTest(unittest.TestCase):
+    # The cell codes of the object board's squares, built from scratch
+    def square_codes(self, board):
+        cells = bytearray()
+        for row in board.squares:
+            for square in row:
+                cells.append(encode_candy(square.candy) | (JELLY if square.jelly else 0))
+        return cells
+
+    def check(self, board):
+        self.assertEqual(board.hash_key(), zobrist_hash(board.encode()))
+        self.assertEqual(board.row_hash, zobrist_rows(board.encode(), board.rows, board.cols))
+        if not isinstance(board, ArrayGameBoard):
+            self.assertEqual(bytes(self.square_codes(board)), bytes(board.encode()))
+
+    def test_incremental_hash(self):
+        for engine in [GameBoard, ArrayGameBoard]:
+            for seed in range(10):
+                random.seed(seed)
+                board = engine(7, 7, "jelly")
+                board.start({"score":10**9, "moves":10**9, "jelly":12})
+                self.check(board)
+                for step in range(15):
+                    moves = board.legal_moves()
+                    if len(moves) == 0:
+                        board.shuffle()
+                    else:
+                        board.move(*moves[random.randrange(len(moves))])
+                    self.check(board)
+                    self.check(board.copyme())
+
+    def test_engines_agree(self):
+        hashes = []
+        for engine in [GameBoard, ArrayGameBoard]:
+            random.seed(5)
+            board = engine(8, 8, "main")
+            board.start({"score":10**9, "moves":10**9})
+            keys = [board.hash_key()]
+            for step in range(10):
+                moves = board.legal_moves()
+                board.move(*moves[random.randrange(len(moves))])
+                keys.append(board.hash_key())
+            hashes.append(keys)
+        self.assertEqual(hashes[0], hashes[1])
+
+if __name__ == "__main__":
+    unittest.main()
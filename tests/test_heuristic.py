@@ -0,0 +1,180 @@
+import random
+import unittest
+from src.cc_simulator import GameBoard, ArrayGameBoard, AIPlayer, Candy, StripedCandy, Chocolate, \
+        CHOCOLATE, STRIPED, HORIZONTAL, JELLY, COLOR_MASK
+
+# The h_func the AI player had before heuristic_terms, one board at a time,
+# with its random stripe direction for a striped candy next to a lone
+# chocolate replaced by the expected value, as h_func_batch has it
+def old_h_func(parent_state, child_state):
+    score_diff = child_state.score - parent_state.score
+    pair_striped = 0
+    pair_choco = 0
+    choco_nearby = {} # Ex. {(row,col):[Candy,StripedCandy,Chocolate,...,]}
+    candy_nearby = 0    # Counts identical color candy nearby
+    color_count = {} # Ex. {'G':1,'R':2}
+    h_val = 0
+
+    if child_state.move_counter >= child_state.goal_value["moves"]:
+        return child_state.score
+
+    for i in Candy.COLORS:
+        color_count[i] = 0
+
+    # A striped candy next to a same colored candy is worth more
+    def stripe_value(candy):
+        if candy.direction == StripedCandy.DIR[0]:
+            return child_state.rows/3.0
+        return child_state.cols/3.0
+
+    def neighbor(row, col):
+        try:
+            return child_state.candy_at(row, col)
+        except IndexError:
+            return None
+
+    for row in range(child_state.rows):
+        for col in range(child_state.cols):
+            candy = child_state.candy_at(row,col)
+            for next_row, next_col in [(row,col+1), (row+1,col)]:
+                other = neighbor(next_row, next_col)
+                if other == None:
+                    if isinstance(candy, Chocolate) and (row,col) not in choco_nearby:
+                        choco_nearby[(row,col)] = []
+                    continue
+                if isinstance(candy, Chocolate):
+                    if (row,col) not in choco_nearby:
+                        choco_nearby[(row,col)] = []
+                    if isinstance(other, Chocolate):
+                        pair_choco = pair_choco + 1
+                        # Avoid double counting
+                        choco_nearby[(row,col)] = None
+                        choco_nearby[(next_row,next_col)] = None
+                    elif choco_nearby[(row,col)] != None:
+                        choco_nearby[(row,col)].append(other)
+                elif isinstance(other, Chocolate):
+                    if (next_row,next_col) not in choco_nearby:
+                        choco_nearby[(next_row,next_col)] = [candy]
+                    elif choco_nearby[(next_row,next_col)] != None:
+                        choco_nearby[(next_row,next_col)].append(candy)
+                elif isinstance(candy, StripedCandy) and isinstance(other, StripedCandy):
+                    pair_striped = pair_striped + 1
+                elif candy.color == other.color:
+                    if isinstance(candy, StripedCandy):
+                        candy_nearby = candy_nearby + stripe_value(candy)
+                    elif isinstance(other, StripedCandy):
+                        candy_nearby = candy_nearby + stripe_value(other)
+                    else:
+                        candy_nearby = candy_nearby + 1
+            if not isinstance(candy, Chocolate):
+                color_count[candy.color] = color_count[candy.color] + 1
+
+    h_val = h_val + (pair_striped*(child_state.rows+child_state.cols))
+    for i in choco_nearby:
+        if choco_nearby[i] == None:
+            continue
+        max_val = 0
+        for j in choco_nearby[i]:
+            if isinstance(j, StripedCandy):
+                val = color_count[j.color]*(child_state.rows+child_state.cols)/2.0
+            else:
+                val = color_count[j.color]
+            if val > max_val:
+                max_val = val
+        # Add one for chocolate
+        h_val = h_val + max_val + 1
+    h_val = h_val + (pair_choco*(child_state.rows*child_state.cols))
+    h_val = h_val + candy_nearby
+    return h_val + score_diff
+
+# Jelly part of h_func, square by square: each jelly square the move cleared,
+# plus the jelly in the line of each striped candy
+def old_h_jelly(parent_state, child_state):
+    cleared = 0
+    reach = 0
+    for row in range(child_state.rows):
+        for col in range(child_state.cols):
+            i = row*child_state.cols+col
+            if parent_state.encode()[i] & JELLY and not child_state.encode()[i] & JELLY:
+                cleared = cleared + 1
+            candy = child_state.candy_at(row, col)
+            if isinstance(candy, StripedCandy):
+                if candy.direction == StripedCandy.DIR[1]:
+                    line = [row*child_state.cols+k for k in range(child_state.cols)]
+                else:
+                    line = [k*child_state.cols+col for k in range(child_state.rows)]
+                for k in line:
+                    if child_state.encode()[k] & JELLY:
+                        reach = reach + 1
+    return cleared*(child_state.rows*child_state.cols) + reach
+
+class HeuristicTest(unittest.TestCase):
+    # Random cell codes with chocolates and striped candies, some on jelly,
+    # and no run of 3 standing
+    def random_cells(self, rng, rows, cols, jelly):
+        cells = bytearray()
+        for i in range(rows*cols):
+            row, col = divmod(i, cols)
+            while True:
+                x = rng.random()
+                if x < 0.06:
+                    code = CHOCOLATE
+                elif x < 0.25:
+                    code = rng.randrange(6) | STRIPED | rng.choice([0, HORIZONTAL])
+                else:
+                    code = rng.randrange(6)
+                color = code & COLOR_MASK
+                if color != CHOCOLATE:
+                    if col >= 2 and cells[i-1] & COLOR_MASK == color and cells[i-2] & COLOR_MASK == color:
+                        continue
+                    if row >= 2 and cells[i-cols] & COLOR_MASK == color and cells[i-2*cols] & COLOR_MASK == color:
+                        continue
+                break
+            if rng.random() < jelly:
+                code = code | JELLY
+            cells.append(code)
+        return cells
+
+    # A fixed parent board of the engine and its children, one per valid move
+    def family(self, engine, seed, rows, cols, mode, jelly):
+        rng = random.Random(seed)
+        random.seed(seed)
+        parent = engine(rows, cols, mode)
+        parent.start({"score":10**9, "moves":10**9, "jelly":1})
+        cells = self.random_cells(rng, rows, cols, jelly)
+        parent.place_cells(cells)
+        parent.jelly_mask = 0
+        for i in range(len(cells)):
+            if cells[i] & JELLY:
+                parent.jelly_mask = parent.jelly_mask | (1 << i)
+        parent.active_jelly = bin(parent.jelly_mask).count("1")
+        children = []
+        for move in parent.legal_moves():
+            child = parent.copyme()
+            child.move(*move)
+            children.append(child)
+        return parent, children
+
+    def test_matches_old_h_func(self):
+        player = AIPlayer(1, 1)
+        for engine in [GameBoard, ArrayGameBoard]:
+            for seed, rows, cols in [(1, 7, 7), (2, 9, 9), (3, 6, 8), (4, 8, 5)]:
+                parent, children = self.family(engine, seed, rows, cols, "main", 0)
+                self.assertGreater(len(children), 0)
+                h_vals = player.h_func_batch(parent, children, 1)
+                for child, h_val in zip(children, h_vals):
+                    self.assertAlmostEqual(h_val, old_h_func(parent, child))
+                    self.assertAlmostEqual(player.h_func(parent, child, 1), h_val)
+
+    def test_matches_old_h_func_with_jelly(self):
+        player = AIPlayer(1, 1)
+        for engine in [GameBoard, ArrayGameBoard]:
+            for seed, rows, cols in [(5, 7, 7), (6, 9, 9), (7, 6, 8)]:
+                parent, children = self.family(engine, seed, rows, cols, "main+jelly", 0.4)
+                self.assertGreater(parent.jelly_mask, 0)
+                h_vals = player.h_func_batch(parent, children, 1)
+                for child, h_val in zip(children, h_vals):
+                    self.assertAlmostEqual(h_val, old_h_func(parent, child) + old_h_jelly(parent, child))
+
+if __name__ == "__main__":
+    unittest.main()
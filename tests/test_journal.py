@@ -0,0 +1,53 @@
+import random
+import unittest
+from src.cc_simulator import GameBoard, ArrayGameBoard
+
+class JournalTest(unittest.TestCase):
+    # Everything a move can change, squares as the object engine prints them
+    def state(self, board):
+        if isinstance(board, ArrayGameBoard):
+            squares = None
+        else:
+            squares = [square.print_square() for row in board.squares for square in row]
+        return (bytes(board.encode()), squares, board.hash_key(), board.score, board.move_counter,
+                board.active_jelly, board.jelly_mask, board.legal_moves(), random.getstate())
+
+    def test_unmake_restores(self):
+        for engine in [GameBoard, ArrayGameBoard]:
+            for seed in range(8):
+                random.seed(seed)
+                board = engine(7, 7, "jelly")
+                board.start({"score":10**9, "moves":10**9, "jelly":12})
+                for step in range(6):
+                    moves = board.legal_moves()
+                    if len(moves) == 0:
+                        board.shuffle()
+                        continue
+                    before = self.state(board)
+                    for move in moves[:5]:
+                        board.make_move(*move)
+                        replies = board.legal_moves()
+                        if len(replies) > 0:
+                            board.make_move(*replies[0])
+                            board.unmake_move()
+                        board.unmake_move()
+                        self.assertEqual(self.state(board), before)
+                    # Nothing is journaled once the last move is taken back
+                    self.assertEqual(board.changes, None)
+                    board.move(*moves[random.randrange(len(moves))])
+
+    def test_only_changed_squares(self):
+        for engine in [GameBoard, ArrayGameBoard]:
+            random.seed(3)
+            board = engine(9, 9, "main")
+            board.start({"score":10**9, "moves":10**9})
+            before = board.copyme()
+            board.make_move(*board.legal_moves()[0])
+            # Every square that differs is journaled, and not the whole board
+            journaled = set(board.changes[0::2])
+            self.assertTrue(set(board.changed_squares(before)) <= journaled)
+            self.assertLess(len(journaled), 81)
+            board.unmake_move()
+
+if __name__ == "__main__":
+    unittest.main()
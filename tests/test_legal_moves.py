@@ -0,0 +1,111 @@
+import random
+import unittest
+from src.cc_simulator import GameBoard, ArrayGameBoard, batch_legal_moves, find_matches, \
+        CHOCOLATE, STRIPED, HORIZONTAL, JELLY, COLOR_MASK
+
+class LegalMovesTest(unittest.TestCase):
+    # Random cell codes: plain, striped and chocolate candies, some on jelly,
+    # with no run of 3 standing, as on a board waiting for a move
+    def random_cells(self, rng, rows, cols):
+        cells = bytearray()
+        for i in range(rows*cols):
+            row, col = divmod(i, cols)
+            while True:
+                x = rng.random()
+                if x < 0.05:
+                    code = CHOCOLATE
+                elif x < 0.2:
+                    code = rng.randrange(6) | STRIPED | rng.choice([0, HORIZONTAL])
+                else:
+                    code = rng.randrange(6)
+                color = code & COLOR_MASK
+                if color == CHOCOLATE:
+                    break
+                if col >= 2 and cells[i-1] & COLOR_MASK == color and cells[i-2] & COLOR_MASK == color:
+                    continue
+                if row >= 2 and cells[i-cols] & COLOR_MASK == color and cells[i-2*cols] & COLOR_MASK == color:
+                    continue
+                break
+            if rng.random() < 0.2:
+                code = code | JELLY
+            cells.append(code)
+        return cells
+
+    # Length of the run of color through square (row, col) along (dr, dc)
+    def run_length(self, cells, rows, cols, row, col, dr, dc):
+        color = cells[row*cols+col] & COLOR_MASK
+        length = 1
+        for step in [1, -1]:
+            r, c = row+step*dr, col+step*dc
+            while 0 <= r < rows and 0 <= c < cols and cells[r*cols+c] & COLOR_MASK == color:
+                length = length + 1
+                r, c = r+step*dr, c+step*dc
+        return length
+
+    # Swap every pair of neighbors and see if it lines up 3 candies, or is a
+    # chocolate or striped+striped swap
+    def brute_force(self, cells, rows, cols):
+        moves = []
+        for row in range(rows):
+            for col in range(cols):
+                for direction, r, c in [("r", row, col+1), ("d", row+1, col)]:
+                    if r >= rows or c >= cols:
+                        continue
+                    i, j = row*cols+col, r*cols+c
+                    if cells[i] & COLOR_MASK == CHOCOLATE or cells[j] & COLOR_MASK == CHOCOLATE \
+                            or (cells[i] & STRIPED and cells[j] & STRIPED):
+                        moves.append((row, col, direction))
+                        continue
+                    swapped = bytearray(cells)
+                    swapped[i], swapped[j] = cells[j], cells[i]
+                    for k in [i, j]:
+                        krow, kcol = divmod(k, cols)
+                        if self.run_length(swapped, rows, cols, krow, kcol, 0, 1) >= 3 \
+                                or self.run_length(swapped, rows, cols, krow, kcol, 1, 0) >= 3:
+                            moves.append((row, col, direction))
+                            break
+        return moves
+
+    # A started board of the engine, its squares set to cells
+    def board(self, engine, rows, cols, cells):
+        board = engine(rows, cols, "main")
+        random.seed(0)
+        board.start({"score":10**9, "moves":10**9})
+        board.place_cells(cells)
+        return board
+
+    def test_legal_moves(self):
+        rng = random.Random(1)
+        for n in range(200):
+            rows, cols = rng.randint(2, 9), rng.randint(2, 9)
+            cells = self.random_cells(rng, rows, cols)
+            expected = self.brute_force(cells, rows, cols)
+            for engine in [GameBoard, ArrayGameBoard]:
+                self.assertEqual(self.board(engine, rows, cols, cells).legal_moves(), expected)
+
+    def test_incremental_cache(self):
+        rng = random.Random(2)
+        for engine in [GameBoard, ArrayGameBoard]:
+            rows, cols = 8, 8
+            board = self.board(engine, rows, cols, self.random_cells(rng, rows, cols))
+            for n in range(200):
+                board.legal_moves()
+                # A few squares change, so only the swaps around them are
+                # looked at again; a change that lines up 3 is taken back
+                for code in self.random_cells(rng, 1, rng.randint(1, 6)):
+                    i = rng.randrange(rows*cols)
+                    old = board.encode()[i]
+                    board.put_cell(i, code)
+                    if len(find_matches(board.encode(), rows, cols)) > 0:
+                        board.put_cell(i, old)
+                self.assertEqual(board.legal_moves(), self.brute_force(board.encode(), rows, cols))
+
+    def test_batch_legal_moves(self):
+        rng = random.Random(3)
+        for rows, cols in [(5, 5), (7, 9), (9, 6)]:
+            boards = [self.board(ArrayGameBoard, rows, cols, self.random_cells(rng, rows, cols)) for n in range(30)]
+            expected = [self.brute_force(board.encode(), rows, cols) for board in boards]
+            self.assertEqual(batch_legal_moves(boards, rows, cols), expected)
+
+if __name__ == "__main__":
+    unittest.main()
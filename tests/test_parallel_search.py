@@ -0,0 +1,30 @@
+import unittest
+from src.cc_simulator import Driver
+
+class ParallelSearchTest(unittest.TestCase):
+    # Move played and root children's scores for each move of a seeded game
+    def play(self, workers):
+        test = Driver(1, "board")
+        test.append_game(7, 7, "main", "array")
+        test.append_player("ai", 3, 9, workers)
+        player = test.players[0]
+        moves = []
+        next_move = player.next_move
+        def record():
+            next_move()
+            tree = player.gameTree
+            moves.append((player.gameBoard.last_move, [round(tree.score[i], 9) for i in tree.children(0)]))
+        player.next_move = record
+        try:
+            test.play_game(0, 0, {"score":10**9, "moves":3})
+        finally:
+            player.close()
+        return moves, test.gameBoards[0].score
+
+    def test_workers_match_serial(self):
+        # On the board's own stream every subtree sees the refills the
+        # serial search does, so scores and moves are the same
+        self.assertEqual(self.play(2), self.play(1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import random
+import unittest
+from src.cc_simulator import Driver, RandomBatch
+
+class RandomBatchTest(unittest.TestCase):
+    SEEDS = [3, 11, 12, 40, "x"]
+    GOAL = {"score":10**9, "moves":15, "jelly":8}
+
+    # The board a RandomPlayer game of Driver(seed) ends with
+    def play(self, seed, rng, mode):
+        test = Driver(seed, rng)
+        test.append_game(6, 7, mode, "array")
+        test.append_player("random")
+        test.play_game(0, 0, dict(RandomBatchTest.GOAL))
+        return test.gameBoards[0]
+
+    def test_batch_plays_games_one_by_one(self):
+        for rng in Driver.RNG:
+            for mode in ["main", "jelly"]:
+                with self.subTest(rng=rng, mode=mode):
+                    random.seed(99)
+                    state = random.getstate()
+                    batch = RandomBatch(6, 7, mode, RandomBatchTest.SEEDS, dict(RandomBatchTest.GOAL), None, rng)
+                    boards = batch.play()
+                    # The batch leaves the random module alone
+                    self.assertEqual(random.getstate(), state)
+                    for seed, board in zip(RandomBatchTest.SEEDS, boards):
+                        alone = self.play(seed, rng, mode)
+                        self.assertEqual(bytes(board.encode()), bytes(alone.encode()))
+                        self.assertEqual((board.score, board.move_counter, board.jelly_mask),
+                                         (alone.score, alone.move_counter, alone.jelly_mask))
+
+if __name__ == "__main__":
+    unittest.main()
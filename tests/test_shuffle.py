@@ -0,0 +1,53 @@
+import random
+import unittest
+from src.cc_simulator import GameBoard, ArrayGameBoard, find_matches, CANDY_MASK, JELLY
+
+class ShuffleTest(unittest.TestCase):
+    # A started board of each engine, its candies set to the given color indexes
+    def boards(self, rows, cols, colors):
+        boards = []
+        for board in [GameBoard(rows, cols, "main"), ArrayGameBoard(rows, cols, "main")]:
+            random.seed(1)
+            board.start({"score":10**9, "moves":10**9})
+            board.place_cells(bytearray(colors))
+            boards.append(board)
+        return boards
+
+    def test_no_color_three_times(self):
+        # 9 squares, no color 3 times: no arrangement of these candies has a move
+        for board in self.boards(3, 3, [0, 0, 1, 1, 2, 2, 3, 3, 4]):
+            random.seed(2)
+            retries = board.shuffle()
+            self.assertGreaterEqual(retries, GameBoard.SHUFFLE_TRIES)
+            self.assertEqual(len(find_matches(board.encode(), 3, 3)), 0)
+            self.assertGreater(len(board.legal_moves()), 0)
+
+    def test_engines_agree(self):
+        boards = self.boards(3, 3, [0, 0, 1, 1, 2, 2, 3, 3, 4])
+        for board in boards:
+            random.seed(3)
+            board.shuffle()
+        self.assertEqual(bytes(boards[0].encode()), bytes(boards[1].encode()))
+
+    def test_keeps_candies_and_jelly(self):
+        # Plain, striped and chocolate candies, jelly on the first row
+        colors = [0x40, 0x49, 0x46, 0x42, 0x1b, 0x04, 0x05, 0x00, 0x01,
+                  0x02, 0x03, 0x04, 0x06, 0x0d, 0x01, 0x02]
+        for board in self.boards(4, 4, colors):
+            random.seed(5)
+            board.shuffle()
+            cells = board.encode()
+            self.assertEqual(sorted(code & CANDY_MASK for code in cells), sorted(code & CANDY_MASK for code in colors))
+            self.assertEqual([code & JELLY for code in cells], [code & JELLY for code in colors])
+            self.assertEqual(len(find_matches(cells, 4, 4)), 0)
+            self.assertGreater(len(board.legal_moves()), 0)
+
+    def test_board_without_moves_raises(self):
+        # 1x3: a swap only reorders 3 squares, so no colors ever make a match
+        for board in self.boards(1, 3, [0, 1, 2]):
+            random.seed(4)
+            with self.assertRaises(Exception):
+                board.shuffle()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import random
+import statistics
+import unittest
+from src.runner import RunningMedian, GameStats
+
+class StatsTest(unittest.TestCase):
+    INPUTS = [[7], [3, 1], [5, 1, 4], [2, 8, 2, 8], [1, 1, 1], [4, -2, 9, 0, 3, 3, 10, -7],
+              [0.5, 2.25, 1.75, 9.5, 3.0]]
+
+    def random_inputs(self):
+        rng = random.Random(1)
+        inputs = []
+        for n in [1, 2, 3, 10, 11, 100, 101]:
+            inputs.append([rng.randrange(-50, 500) for i in range(n)])
+        return inputs
+
+    def test_running_median(self):
+        for values in StatsTest.INPUTS + self.random_inputs():
+            median = RunningMedian()
+            for k in range(len(values)):
+                median.add(values[k])
+                seen = values[:k+1]
+                self.assertEqual(len(median), len(seen))
+                # The upper of the two middle values when there is an even
+                # count, as the summary always reported
+                if len(seen) % 2 == 1:
+                    self.assertEqual(median.median(), statistics.median(seen))
+                self.assertEqual(median.median(), statistics.median_high(seen))
+
+    def test_game_stats(self):
+        for values in StatsTest.INPUTS + self.random_inputs():
+            stats = GameStats()
+            for value in values:
+                result = dict.fromkeys(GameStats.FIELDS, 0)
+                result["score"] = value
+                result["moves"] = 2
+                stats.add(result)
+            self.assertEqual(stats.count, len(values))
+            self.assertAlmostEqual(stats.average("score"), statistics.mean(values))
+            self.assertAlmostEqual(stats.mean_score, statistics.mean(values))
+            self.assertAlmostEqual(stats.std_dev(), statistics.pstdev(values))
+            self.assertAlmostEqual(stats.per_move("score"), statistics.mean(values)/2)
+            self.assertEqual(stats.median.median(), statistics.median_high(values))
+
+    def test_no_moves(self):
+        stats = GameStats()
+        stats.add(dict.fromkeys(GameStats.FIELDS, 0))
+        self.assertEqual(stats.per_move("score"), 0)
+        self.assertEqual(stats.std_dev(), 0)
+
+if __name__ == "__main__":
+    unittest.main()